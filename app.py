@@ -1,95 +1,329 @@
 import os
 import sys
+import json
+import time
+import logging
+import secrets
+import functools
 
 # Fix Windows encoding issue with EasyOCR's Unicode progress bar characters
 if sys.platform == 'win32':
     sys.stdout.reconfigure(encoding='utf-8', errors='replace')
     sys.stderr.reconfigure(encoding='utf-8', errors='replace')
 
-from flask import Flask, request, jsonify, send_file, render_template
+import click
+from flask import Flask, request, jsonify, send_file, render_template, g, Response
 from werkzeug.utils import secure_filename
-from config import UPLOAD_FOLDER, MAX_CONTENT_LENGTH, ALLOWED_EXTENSIONS
-from database import init_db, get_all_analyses, get_analysis_by_id, delete_analysis, get_analyses_by_ids
-from services.analysis_service import analyze_image
-from services.pdf_service import generate_pdf
+from config import (
+    UPLOAD_FOLDER, MAX_CONTENT_LENGTH, ALLOWED_EXTENSIONS, REPORT_CACHE_ENABLED,
+    METRICS_TIMING_LOG, METRICS_TIMING_LOG_MIN_MS, OCR_PROFILES, HISTORY_CHANGES_PAGE_SIZE,
+    UPLOAD_CACHE_MAX_AGE
+)
+from database import (
+    init_db, get_all_analyses, get_analysis_by_id, delete_analysis, get_analyses_by_ids, get_changes
+)
+from services.analysis_service import analyze_image, iter_analysis
+from services.image_processor import ImageMemoryError, ImageRejectedError
+from services.ocr_service import normalize_languages
+from services.pdf_service import get_report, render_pdf_buffer, generate_comparison_pdf
+from services.storage_service import sweep, start_sweeper, delete_analysis_files
+from services.thumbnail_service import schedule_derivatives, generate_derivatives, thumbnail_urls
+from services.metrics import (
+    render_metrics, begin_request_spans, end_request_spans, iter_with_spans, HTTP_REQUEST_SECONDS,
+    ANALYSES_TOTAL
+)
+from services.asset_service import build_assets, asset_url, send_asset
+from services.profiling_service import (
+    install_profiler, token_valid, list_captures, get_capture, capture_stats_path, PROFILE_HEADER
+)
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+install_profiler(app)
 
 # Ensure folders exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+timing_logger = logging.getLogger('nutricheck.timing')
+if METRICS_TIMING_LOG and not timing_logger.handlers:
+    timing_logger.addHandler(logging.StreamHandler())
+    timing_logger.setLevel(logging.INFO)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.spans_token = begin_request_spans()
+
+
+@app.after_request
+def record_request_metrics(response):
+    if 'request_start' not in g:
+        return response
+    spans = end_request_spans(g.pop('spans_token'))
+    record = functools.partial(
+        record_request, request.method, request.path,
+        request.url_rule.rule if request.url_rule else 'unmatched',
+        response.status_code, g.request_start, spans)
+    if response.is_streamed:
+        # A streamed body (e.g. SSE) is produced after this hook returns: keep
+        # collecting its spans, and time the request when the body is closed
+        if not response.direct_passthrough:
+            response.response = iter_with_spans(response.response, spans)
+        response.call_on_close(record)
+    else:
+        record()
+    return response
+
+
+def record_request(method, path, endpoint, status, start, spans):
+    """Observe a finished request's latency and write its timing log line."""
+    elapsed = time.perf_counter() - start
+    HTTP_REQUEST_SECONDS.observe(elapsed, method=method, endpoint=endpoint, status=str(status))
+
+    if METRICS_TIMING_LOG and elapsed * 1000 >= METRICS_TIMING_LOG_MIN_MS:
+        timing_logger.info(json.dumps({
+            'method': method,
+            'path': path,
+            'status': status,
+            'total_ms': round(elapsed * 1000, 2),
+            'spans': [{'name': name, 'ms': round(sec * 1000, 2)} for name, sec in spans],
+        }))
+
+
+@app.after_request
+def set_static_cache_headers(response):
+    if request.endpoint != 'static':
+        return response
+    filename = (request.view_args or {}).get('filename', '')
+    if response.status_code >= 400:
+        # e.g. a thumbnail not generated yet: must not be cached as missing
+        return response
+    if filename.startswith(('uploads/', 'derived/')):
+        # Written once under a unique name, never modified in place (derivative
+        # names include their settings, see thumbnail_service.DERIVATIVE_SUFFIXES)
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = UPLOAD_CACHE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        # Unfingerprinted sources (assets not built): always revalidate via ETag
+        response.cache_control.no_cache = True
+    return response
+
+
+@app.context_processor
+def inject_asset_url():
+    # The debug server serves sources directly so edits show up without a rebuild
+    return {'asset_url': lambda source: asset_url(source, use_build=not app.debug)}
+
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def add_image_urls(analysis):
+    """Attach the upload URL and, once generated, thumbnail URLs."""
+    if analysis.get('image_path'):
+        analysis['image_url'] = '/static/uploads/' + os.path.basename(analysis['image_path'])
+        analysis.update(thumbnail_urls(analysis['image_path']))
+    return analysis
+
+
+@app.route('/assets/<path:filename>')
+def assets(filename):
+    """Fingerprinted, precompressed static assets (see `flask assets`)."""
+    return send_asset(filename)
+
+
 @app.route('/')
 def index():
     """Serve the main single-page application."""
     return render_template('index.html')
 
 
-@app.route('/api/analyze', methods=['POST'])
-def api_analyze():
-    """Upload an image and run full analysis pipeline."""
+def save_upload():
+    """
+    Validate and store the uploaded image.
+
+    Returns:
+        (filepath, None) on success or (None, error response) on failure
+    """
     if 'image' not in request.files:
-        return jsonify({'error': 'No image file provided'}), 400
+        return None, (jsonify({'error': 'No image file provided'}), 400)
 
     file = request.files['image']
     if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
+        return None, (jsonify({'error': 'No file selected'}), 400)
 
     if not allowed_file(file.filename):
-        return jsonify({'error': f'File type not allowed. Use: {", ".join(ALLOWED_EXTENSIONS)}'}), 400
+        return None, (jsonify({'error': f'File type not allowed. Use: {", ".join(ALLOWED_EXTENSIONS)}'}), 400)
 
     # Save uploaded file
     filename = secure_filename(file.filename)
-    # Add timestamp to avoid collisions
-    import time
+    # Add timestamp + random suffix: names are never reused, so uploads can be cached as immutable
     name, ext = os.path.splitext(filename)
-    filename = f"{name}_{int(time.time())}{ext}"
+    filename = f"{name}_{int(time.time())}_{secrets.token_hex(4)}{ext}"
     filepath = os.path.join(UPLOAD_FOLDER, filename)
     file.save(filepath)
+    # Thumbnails and the report image are produced alongside OCR
+    schedule_derivatives(filepath)
+    return filepath, None
 
+
+def parse_languages():
+    """Read the optional `languages` form field. Returns (languages, error_response)."""
+    hint = request.form.get('languages')
+    if not hint:
+        return None, None
     try:
-        result = analyze_image(filepath)
-        # Make image path relative for frontend
-        result['image_url'] = f'/static/uploads/{filename}'
-        # Remove non-serializable keys if any
-        result.pop('breakdown', None)
+        return list(normalize_languages(hint)), None
+    except ValueError as e:
+        return None, (jsonify({'error': str(e)}), 400)
+
+
+def parse_compare_ids():
+    """
+    Read the JSON `ids` list for comparisons: integers (numeric strings
+    accepted), duplicates dropped, order kept. Returns (ids, error_response).
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('ids'), list):
+        return None, (jsonify({'error': 'Provide list of analysis IDs'}), 400)
+    ids = []
+    for value in data['ids']:
+        if isinstance(value, int) and not isinstance(value, bool):
+            analysis_id = value
+        elif isinstance(value, str) and value.strip().isdigit():
+            analysis_id = int(value)
+        else:
+            return None, (jsonify({'error': f'Invalid analysis ID: {value!r}'}), 400)
+        if analysis_id not in ids:
+            ids.append(analysis_id)
+    if len(ids) < 2:
+        return None, (jsonify({'error': 'Need at least 2 products to compare'}), 400)
+    return ids, None
+
+
+def finish_result(result):
+    """Make an analysis result JSON-ready for the frontend."""
+    # Make image path relative for frontend
+    result['image_url'] = '/static/uploads/' + os.path.basename(result['image_path'])
+    # Remove non-serializable keys if any
+    result.pop('breakdown', None)
+    return result
+
+
+@app.route('/api/analyze', methods=['POST'])
+def api_analyze():
+    """Upload an image and run full analysis pipeline."""
+    profile = request.form.get('ocr_profile') or None
+    if profile and profile not in OCR_PROFILES:
+        return jsonify({'error': f'Unknown OCR profile. Use: {", ".join(OCR_PROFILES)}'}), 400
+    languages, error = parse_languages()
+    if error:
+        return error
+
+    filepath, error = save_upload()
+    if error:
+        return error
+
+    try:
+        result = finish_result(analyze_image(filepath, profile, languages))
+        ANALYSES_TOTAL.inc(outcome='success')
         return jsonify(result), 200
+    except ImageRejectedError as e:
+        ANALYSES_TOTAL.inc(outcome='rejected')
+        return jsonify({'error': str(e)}), e.status_code
+    except ImageMemoryError as e:
+        ANALYSES_TOTAL.inc(outcome='busy')
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
     except Exception as e:
+        ANALYSES_TOTAL.inc(outcome='error')
         return jsonify({'error': f'Analysis failed: {str(e)}'}), 500
 
 
+def sse_event(event, data):
+    """Format one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route('/api/analyze/stream', methods=['POST'])
+def api_analyze_stream():
+    """Upload an image and stream pipeline progress as Server-Sent Events."""
+    profile = request.form.get('ocr_profile') or None
+    if profile and profile not in OCR_PROFILES:
+        return jsonify({'error': f'Unknown OCR profile. Use: {", ".join(OCR_PROFILES)}'}), 400
+    languages, error = parse_languages()
+    if error:
+        return error
+
+    filepath, error = save_upload()
+    if error:
+        return error
+
+    def generate():
+        try:
+            for event, data in iter_analysis(filepath, profile, languages):
+                if event == 'result':
+                    data = finish_result(data)
+                yield sse_event(event, data)
+            ANALYSES_TOTAL.inc(outcome='success')
+        except ImageRejectedError as e:
+            ANALYSES_TOTAL.inc(outcome='rejected')
+            yield sse_event('error', {'error': str(e), 'status': e.status_code})
+        except ImageMemoryError as e:
+            ANALYSES_TOTAL.inc(outcome='busy')
+            yield sse_event('error', {'error': str(e), 'retry': True})
+        except Exception as e:
+            ANALYSES_TOTAL.inc(outcome='error')
+            yield sse_event('error', {'error': f'Analysis failed: {str(e)}'})
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Stop reverse proxies from buffering the stream
+        'X-Accel-Buffering': 'no',
+    })
+
+
 @app.route('/api/history', methods=['GET'])
 def api_history():
     """Return all analysis history."""
     analyses = get_all_analyses()
-    # Add image URLs
     for a in analyses:
-        if a.get('image_path'):
-            a['image_url'] = '/static/uploads/' + os.path.basename(a['image_path'])
+        add_image_urls(a)
     return jsonify(analyses), 200
 
 
+@app.route('/api/history/changes', methods=['GET'])
+def api_history_changes():
+    """Return analyses inserted or deleted since a client-held change-log cursor."""
+    since = request.args.get('since', 0, type=int)
+    if since < 0:
+        return jsonify({'error': 'since must be a non-negative version'}), 400
+
+    changes = get_changes(since, HISTORY_CHANGES_PAGE_SIZE, request.args.get('epoch'))
+    for a in changes['upserts']:
+        add_image_urls(a)
+    return jsonify(changes), 200
+
+
 @app.route('/api/analysis/<int:analysis_id>', methods=['GET'])
 def api_get_analysis(analysis_id):
     """Return a single analysis by ID."""
     analysis = get_analysis_by_id(analysis_id)
     if not analysis:
         return jsonify({'error': 'Analysis not found'}), 404
-    if analysis.get('image_path'):
-        analysis['image_url'] = '/static/uploads/' + os.path.basename(analysis['image_path'])
-    return jsonify(analysis), 200
+    return jsonify(add_image_urls(analysis)), 200
 
 
 @app.route('/api/analysis/<int:analysis_id>', methods=['DELETE'])
 def api_delete_analysis(analysis_id):
     """Delete an analysis by ID."""
+    analysis = get_analysis_by_id(analysis_id)
     deleted = delete_analysis(analysis_id)
     if deleted:
+        delete_analysis_files(analysis_id, analysis.get('image_path') if analysis else None)
         return jsonify({'message': 'Deleted successfully'}), 200
     return jsonify({'error': 'Analysis not found'}), 404
 
@@ -97,41 +331,198 @@ def api_delete_analysis(analysis_id):
 @app.route('/api/compare', methods=['POST'])
 def api_compare():
     """Compare multiple analyses by IDs."""
-    data = request.get_json()
-    if not data or 'ids' not in data:
-        return jsonify({'error': 'Provide list of analysis IDs'}), 400
-
-    ids = data['ids']
-    if len(ids) < 2:
-        return jsonify({'error': 'Need at least 2 products to compare'}), 400
+    ids, error = parse_compare_ids()
+    if error:
+        return error
 
     analyses = get_analyses_by_ids(ids)
     for a in analyses:
-        if a.get('image_path'):
-            a['image_url'] = '/static/uploads/' + os.path.basename(a['image_path'])
+        add_image_urls(a)
 
     return jsonify(analyses), 200
 
 
 @app.route('/api/report/<int:analysis_id>', methods=['GET'])
 def api_report(analysis_id):
-    """Generate and download PDF report."""
+    """Download the PDF report, rendering it only if the analysis changed."""
     analysis = get_analysis_by_id(analysis_id)
     if not analysis:
         return jsonify({'error': 'Analysis not found'}), 404
 
     try:
-        pdf_path = generate_pdf(analysis)
-        return send_file(
+        if not REPORT_CACHE_ENABLED:
+            return send_file(
+                render_pdf_buffer(analysis),
+                as_attachment=True,
+                download_name=f'nutricheck_report_{analysis_id}.pdf',
+                mimetype='application/pdf'
+            )
+
+        pdf_path, fingerprint, _ = get_report(analysis)
+        response = send_file(
             pdf_path,
             as_attachment=True,
             download_name=f'nutricheck_report_{analysis_id}.pdf',
+            mimetype='application/pdf',
+            etag=fingerprint,
+            conditional=True,
+        )
+        # Clients may keep a copy but must revalidate: a rescore changes the ETag
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    except Exception as e:
+        return jsonify({'error': f'PDF generation failed: {str(e)}'}), 500
+
+
+@app.route('/api/report/compare', methods=['POST'])
+def api_report_compare():
+    """Generate a multi-product comparison PDF, streamed from memory."""
+    ids, error = parse_compare_ids()
+    if error:
+        return error
+
+    # Keep the order the client selected
+    by_id = {a['id']: a for a in get_analyses_by_ids(ids)}
+    analyses = [by_id[i] for i in ids if i in by_id]
+    if len(analyses) < 2:
+        return jsonify({'error': 'Analysis not found'}), 404
+
+    try:
+        return send_file(
+            generate_comparison_pdf(analyses),
+            as_attachment=True,
+            download_name='nutricheck_comparison.pdf',
             mimetype='application/pdf'
         )
     except Exception as e:
         return jsonify({'error': f'PDF generation failed: {str(e)}'}), 500
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics for this worker process."""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+def profile_access_denied():
+    """Capture endpoints need the profile token; they do not exist without it."""
+    if not token_valid(request.headers.get(PROFILE_HEADER)):
+        return jsonify({'error': 'Not found'}), 404
+    return None
+
+
+@app.route('/api/profiles', methods=['GET'])
+def api_profiles():
+    """List stored request profile captures, newest first."""
+    denied = profile_access_denied()
+    if denied:
+        return denied
+    return jsonify(list_captures()), 200
+
+
+@app.route('/api/profiles/<capture_id>', methods=['GET'])
+def api_profile(capture_id):
+    """Return a capture's summary: top functions and top allocations."""
+    denied = profile_access_denied()
+    if denied:
+        return denied
+    capture = get_capture(capture_id)
+    if not capture:
+        return jsonify({'error': 'Capture not found'}), 404
+    return jsonify(capture), 200
+
+
+@app.route('/api/profiles/<capture_id>/download', methods=['GET'])
+def api_profile_download(capture_id):
+    """Download a capture's raw cProfile stats."""
+    denied = profile_access_denied()
+    if denied:
+        return denied
+    path = capture_stats_path(capture_id)
+    if not path:
+        return jsonify({'error': 'Capture not found'}), 404
+    return send_file(path, as_attachment=True, download_name=f'nutricheck_{capture_id}.prof',
+                     mimetype='application/octet-stream')
+
+
+@app.cli.command('assets')
+def assets_command():
+    """Fingerprint and precompress static assets into static/dist."""
+    manifest = build_assets()
+    for source, name in manifest.items():
+        click.echo(f"{source} -> /assets/{name}")
+
+
+@app.cli.command('sweep')
+@click.option('--dry-run', is_flag=True, help='Report what would be deleted without deleting.')
+@click.option('--batch-size', type=int, default=None, help='Files deleted per batch.')
+@click.option('--quota-mb', type=int, default=None, help='Override the storage quota (MB).')
+def sweep_command(dry_run, batch_size, quota_mb):
+    """Delete orphaned uploads/reports and enforce the storage quota."""
+    init_db()
+    kwargs = {'dry_run': dry_run}
+    if batch_size:
+        kwargs['batch_size'] = batch_size
+    if quota_mb is not None:
+        kwargs['quota_bytes'] = quota_mb * 1024 * 1024
+    stats = sweep(**kwargs)
+    prefix = 'Would reclaim' if dry_run else 'Reclaimed'
+    click.echo(
+        f"{prefix} {stats['bytes_reclaimed'] / (1024 * 1024):.2f} MB: "
+        f"{stats['orphans_deleted']} orphaned files, "
+        f"{stats['derived_evicted']} reports/thumbnails evicted over quota"
+    )
+
+
+@app.cli.command('thumbnails')
+def thumbnails_command():
+    """Generate missing thumbnails and report images for existing uploads."""
+    generated = 0
+    for name in sorted(os.listdir(UPLOAD_FOLDER)):
+        path = os.path.join(UPLOAD_FOLDER, name)
+        if os.path.isfile(path) and allowed_file(name) and generate_derivatives(path):
+            generated += 1
+    click.echo(f"Derivatives present for {generated} uploads")
+
+
+@app.cli.command('analyze-batch')
+@click.argument('folder', type=click.Path(exists=True, file_okay=False))
+@click.option('--profile', type=click.Choice(sorted(OCR_PROFILES)), default=None,
+              help='OCR speed/accuracy profile for the whole batch.')
+@click.option('--languages', default=None,
+              help='Comma-separated OCR language hint, e.g. "de" or "fr,en".')
+@click.option('--torch-threads', type=int, default=None,
+              help='Torch intra-op threads for this process.')
+def analyze_batch_command(folder, profile, languages, torch_threads):
+    """Analyze every label image in FOLDER and store the results."""
+    try:
+        languages = list(normalize_languages(languages)) if languages else None
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--languages')
+    init_db()
+    if torch_threads:
+        import torch
+        torch.set_num_threads(torch_threads)
+
+    names = sorted(n for n in os.listdir(folder) if allowed_file(n))
+    batch_start = time.perf_counter()
+    for name in names:
+        path = os.path.abspath(os.path.join(folder, name))
+        start = time.perf_counter()
+        try:
+            result = analyze_image(path, profile, languages)
+            click.echo(f"{name}: #{result['id']} score {result['health_score']} "
+                       f"({time.perf_counter() - start:.2f}s)")
+        except Exception as e:
+            click.echo(f"{name}: failed: {e}", err=True)
+    elapsed = time.perf_counter() - batch_start
+    click.echo(f"{len(names)} images in {elapsed:.1f}s")
+
+
 if __name__ == '__main__':
     init_db()
+    # The debug reloader runs this block in two processes; sweep only in the serving one
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_sweeper()
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -10,8 +10,13 @@ MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16 MB max upload
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp', 'webp'}
 
 # OCR Configuration
-OCR_LANGUAGES = ['en']
+OCR_LANGUAGES = ['en']  # default reader when a request gives no language hint
 OCR_GPU = False  # Set True if CUDA-capable GPU available
+# Language hints accepted per request (EasyOCR codes; each has a keyword table in nutrient_parser)
+OCR_SUPPORTED_LANGUAGES = ['en', 'fr', 'de', 'es', 'it']
+OCR_READER_POOL_SIZE = 3                          # readers kept loaded per process
+OCR_READER_POOL_BUDGET_BYTES = 600 * 1024 * 1024  # model weights kept loaded per process
+OCR_READER_SIZE_ESTIMATE_BYTES = 100 * 1024 * 1024  # room made before loading a reader
 
 # Image preprocessing
 IMG_MAX_WIDTH = 1200
@@ -30,3 +35,113 @@ DAILY_REFERENCE = {
     'protein': 50,
     'fiber': 28
 }
+
+# Storage housekeeping (orphaned uploads/reports sweeper)
+SWEEP_INTERVAL_SECONDS = 15 * 60  # background sweep cadence; 0 disables the thread
+SWEEP_BATCH_SIZE = 200            # files deleted per batch before yielding
+SWEEP_LOCK_PATH = os.path.join(BASE_DIR, 'sweeper.lock')  # elects the one gunicorn worker that sweeps
+ORPHAN_GRACE_SECONDS = 10 * 60    # skip files younger than this (upload still being analyzed)
+STORAGE_QUOTA_BYTES = 2 * 1024 * 1024 * 1024  # 2 GB cap for uploads + reports; None disables
+
+# PDF reports
+REPORT_CACHE_ENABLED = True  # False renders each report in memory and streams it
+
+# Image derivatives generated at upload time
+DERIVED_FOLDER = os.path.join(BASE_DIR, 'static', 'derived')
+THUMB_MAX_SIZE = 320            # longest side of list-view thumbnails (px)
+THUMB_WEBP_QUALITY = 75
+THUMB_JPEG_QUALITY = 80
+PDF_IMAGE_MAX_WIDTH = 600       # report-embedded derivative
+PDF_IMAGE_MAX_HEIGHT = 800
+PDF_IMAGE_JPEG_QUALITY = 80
+THUMBNAIL_WORKERS = 2           # background threads generating derivatives
+DERIVATIVE_VERSION = 1          # bump when the derivative encoding code changes (new file names)
+
+# Production serving (gunicorn.conf.py)
+SERVE_BIND = '0.0.0.0:8000'
+SERVE_WORKERS = os.cpu_count() or 2    # preforked worker processes
+SERVE_THREADS = 4                      # request threads per worker
+SERVE_MAX_REQUESTS = 500               # recycle a worker after this many requests
+SERVE_MAX_REQUESTS_JITTER = 50         # stagger recycling so workers don't restart together
+SERVE_TIMEOUT = 120                    # seconds; OCR on large labels is slow
+SERVE_GRACEFUL_TIMEOUT = 60            # seconds to finish in-flight requests on restart
+OCR_MAX_CONCURRENT = 1                 # simultaneous OCR inferences per worker
+OCR_TORCH_THREADS = 1                  # torch intra-op threads per worker (workers already fill the cores)
+
+# Metrics & timing
+METRICS_TIMING_LOG = False        # log one JSON line of stage timings per request
+METRICS_TIMING_LOG_MIN_MS = 0     # only log requests slower than this (tail-latency hunting)
+# Shared directory for per-process metric snapshots (set by gunicorn.conf.py); None = single process
+METRICS_MULTIPROC_DIR = os.environ.get('NUTRICHECK_METRICS_DIR') or None
+METRICS_FLUSH_SECONDS = 1.0       # how often each process writes its snapshot
+
+# OCR backend: 'live' runs EasyOCR; 'record' runs it and saves results to
+# OCR_RECORDINGS_PATH; 'replay' serves saved results without loading the model
+# (load-testing the web, database and PDF layers in isolation)
+OCR_MODE = os.environ.get('NUTRICHECK_OCR_MODE', 'live')
+OCR_RECORDINGS_PATH = os.environ.get(
+    'NUTRICHECK_OCR_RECORDINGS', os.path.join(BASE_DIR, 'loadtest', 'ocr_recordings.json')
+)
+
+# OCR speed/accuracy profiles, selectable per request ('ocr_profile' form field)
+# or per batch ('flask analyze-batch --profile'). Keys map to EasyOCR readtext():
+#   canvas_size / mag_ratio  detector input size and magnification
+#   batch_size               recognizer batch size
+#   decoder / beam_width     'greedy' or 'beamsearch' decoding
+#   value_allowlist          re-read numeric boxes restricted to these characters
+OCR_DEFAULT_PROFILE = 'balanced'
+OCR_VALUE_ALLOWLIST = '0123456789.,%gmkcalKJ'
+OCR_PROFILES = {
+    'fast': {
+        'canvas_size': 1280,
+        'mag_ratio': 1.0,
+        'batch_size': 16,
+        'decoder': 'greedy',
+        'beam_width': 5,
+        'value_allowlist': None,
+    },
+    # EasyOCR defaults
+    'balanced': {
+        'canvas_size': 2560,
+        'mag_ratio': 1.0,
+        'batch_size': 1,
+        'decoder': 'greedy',
+        'beam_width': 5,
+        'value_allowlist': None,
+    },
+    'accurate': {
+        'canvas_size': 3200,
+        'mag_ratio': 1.5,
+        'batch_size': 1,
+        'decoder': 'beamsearch',
+        'beam_width': 10,
+        'value_allowlist': OCR_VALUE_ALLOWLIST,
+    },
+}
+
+# Image decoding & memory
+IMAGE_MAX_PIXELS = 100_000_000    # reject larger images (decompression bombs)
+IMAGE_MEMORY_BUDGET_BYTES = 256 * 1024 * 1024  # decoded-image bytes in flight per process
+IMAGE_MEMORY_WAIT_SECONDS = 30    # wait this long for budget before rejecting with 503
+
+# History change feed
+HISTORY_CHANGES_PAGE_SIZE = 500   # max change-log entries per /api/history/changes response
+
+# Request profiling (off unless a token or sample rate is set)
+PROFILE_TOKEN = os.environ.get('NUTRICHECK_PROFILE_TOKEN', '')  # X-NutriCheck-Profile header value
+PROFILE_SAMPLE_RATE = float(os.environ.get('NUTRICHECK_PROFILE_SAMPLE_RATE', '0'))  # 0.0-1.0
+PROFILE_FOLDER = os.path.join(BASE_DIR, 'profiles')  # not under static/: captures expose code paths
+PROFILE_RING_SIZE = 50            # captures kept on disk, oldest deleted first
+PROFILE_TOP_FUNCTIONS = 30        # functions (by cumulative time) in a capture summary
+PROFILE_TOP_ALLOCATIONS = 25      # allocation sites (by live size) in a capture summary
+PROFILE_TRACEMALLOC_FRAMES = 1    # stack depth recorded per allocation
+PROFILE_MAX_CAPTURE_SECONDS = 30  # capture wall time after which tracemalloc stops (it slows the whole worker)
+
+# Static assets (fingerprinted + precompressed by `flask assets` / wsgi.py)
+ASSET_SOURCES = ['css/style.css', 'js/store.js', 'js/dashboard.js', 'js/history.js',
+                 'js/comparison.js', 'js/app.js']  # relative to static/
+ASSET_DIST_FOLDER = os.path.join(BASE_DIR, 'static', 'dist')
+ASSET_CACHE_MAX_AGE = 365 * 24 * 3600   # hashed assets never change under the same URL
+UPLOAD_CACHE_MAX_AGE = 30 * 24 * 3600   # uploads/derivatives are write-once under unique names
+ASSET_GZIP_LEVEL = 9
+ASSET_BROTLI_QUALITY = 11
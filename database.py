@@ -1,6 +1,7 @@
 import sqlite3
 import os
 from config import DATABASE_PATH
+from services.metrics import timed_db
 
 
 def get_db():
@@ -33,11 +34,42 @@ def init_db():
             raw_ocr_text    TEXT,
             created_at      DATETIME DEFAULT CURRENT_TIMESTAMP
         );
+
+        -- Append-only change feed for /api/history/changes; version is the sync cursor
+        CREATE TABLE IF NOT EXISTS analysis_changes (
+            version         INTEGER PRIMARY KEY AUTOINCREMENT,
+            analysis_id     INTEGER NOT NULL,
+            op              TEXT NOT NULL CHECK (op IN ('upsert', 'delete')),
+            changed_at      DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_analysis_changes_analysis
+            ON analysis_changes (analysis_id);
+
+        -- Database-wide settings; 'epoch' is a random ID chosen when the database is created,
+        -- so change-log cursors from another (e.g. recreated) database are detected
+        CREATE TABLE IF NOT EXISTS meta (
+            key             TEXT PRIMARY KEY,
+            value           TEXT NOT NULL
+        );
+        INSERT OR IGNORE INTO meta (key, value) VALUES ('epoch', lower(hex(randomblob(8))));
     ''')
+    # Databases created before the change log: record existing rows once
+    if conn.execute('SELECT COUNT(*) FROM analysis_changes').fetchone()[0] == 0:
+        conn.execute('''
+            INSERT INTO analysis_changes (analysis_id, op)
+            SELECT id, 'upsert' FROM analyses ORDER BY id
+        ''')
     conn.commit()
     conn.close()
 
 
+def _log_change(conn, analysis_id, op):
+    """Append to the change log inside the caller's transaction."""
+    conn.execute('INSERT INTO analysis_changes (analysis_id, op) VALUES (?, ?)',
+                 (analysis_id, op))
+
+
+@timed_db('save_analysis')
 def save_analysis(data):
     """Save an analysis result and return the inserted row ID."""
     conn = get_db()
@@ -61,12 +93,14 @@ def save_analysis(data):
         data.get('recommendation'),
         data.get('raw_ocr_text')
     ))
-    conn.commit()
     row_id = cursor.lastrowid
+    _log_change(conn, row_id, 'upsert')
+    conn.commit()
     conn.close()
     return row_id
 
 
+@timed_db('get_all_analyses')
 def get_all_analyses():
     """Return all analyses ordered by most recent."""
     conn = get_db()
@@ -77,6 +111,7 @@ def get_all_analyses():
     return [dict(r) for r in rows]
 
 
+@timed_db('get_analysis_by_id')
 def get_analysis_by_id(analysis_id):
     """Return a single analysis by ID."""
     conn = get_db()
@@ -87,16 +122,29 @@ def get_analysis_by_id(analysis_id):
     return dict(row) if row else None
 
 
+@timed_db('delete_analysis')
 def delete_analysis(analysis_id):
     """Delete an analysis by ID. Returns True if a row was deleted."""
     conn = get_db()
     cursor = conn.execute('DELETE FROM analyses WHERE id = ?', (analysis_id,))
-    conn.commit()
     deleted = cursor.rowcount > 0
+    if deleted:
+        _log_change(conn, analysis_id, 'delete')
+    conn.commit()
     conn.close()
     return deleted
 
 
+@timed_db('get_image_references')
+def get_image_references():
+    """Return {analysis_id: image_path} for every stored analysis."""
+    conn = get_db()
+    rows = conn.execute('SELECT id, image_path FROM analyses').fetchall()
+    conn.close()
+    return {r['id']: r['image_path'] for r in rows}
+
+
+@timed_db('get_analyses_by_ids')
 def get_analyses_by_ids(ids):
     """Return analyses matching the given list of IDs."""
     if not ids:
@@ -108,3 +156,67 @@ def get_analyses_by_ids(ids):
     ).fetchall()
     conn.close()
     return [dict(r) for r in rows]
+
+
+@timed_db('get_changes')
+def get_changes(since, limit, epoch=None):
+    """
+    Return analyses changed after change-log version `since` of database `epoch`.
+
+    Returns:
+        dict with 'version' and 'epoch' (cursor to pass next time), 'upserts'
+        (full rows), 'deleted' (IDs), 'has_more' (more than `limit` changes
+        pending) and 'reset' (the cursor belongs to another database, e.g.
+        one that was recreated, or is ahead of the log)
+    """
+    conn = get_db()
+    current_epoch = conn.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()[0]
+    latest = conn.execute('SELECT COALESCE(MAX(version), 0) FROM analysis_changes').fetchone()[0]
+    reset = since > 0 and (epoch != current_epoch or since > latest)
+    if reset:
+        since = 0
+    changes = conn.execute(
+        'SELECT version, analysis_id, op FROM analysis_changes WHERE version > ? '
+        'ORDER BY version LIMIT ?', (since, limit + 1)
+    ).fetchall()
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    # Only the last change per analysis matters
+    last_op = {}
+    for c in changes:
+        last_op[c['analysis_id']] = c['op']
+    upsert_ids = [i for i, op in last_op.items() if op == 'upsert']
+    rows = []
+    if upsert_ids:
+        placeholders = ','.join('?' for _ in upsert_ids)
+        rows = conn.execute(
+            f'SELECT * FROM analyses WHERE id IN ({placeholders})', upsert_ids
+        ).fetchall()
+    conn.close()
+    found = {r['id'] for r in rows}
+
+    return {
+        'version': changes[-1]['version'] if changes else latest,
+        'epoch': current_epoch,
+        'upserts': [dict(r) for r in rows],
+        # An upserted row that no longer exists is reported as deleted
+        'deleted': [i for i, op in last_op.items() if op == 'delete' or i not in found],
+        'has_more': has_more,
+        'reset': reset,
+    }
+
+
+@timed_db('compact_changes')
+def compact_changes():
+    """Drop change-log entries superseded by a later change to the same analysis."""
+    conn = get_db()
+    cursor = conn.execute('''
+        DELETE FROM analysis_changes WHERE version NOT IN (
+            SELECT MAX(version) FROM analysis_changes GROUP BY analysis_id
+        )
+    ''')
+    conn.commit()
+    removed = cursor.rowcount
+    conn.close()
+    return removed
@@ -0,0 +1,71 @@
+"""
+Gunicorn settings for production serving. Values come from config.py;
+WEB_CONCURRENCY and PORT environment variables override workers/bind.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Signals (sent to the master):
+    HUP   graceful restart of all workers (the preloaded app is kept)
+    USR2  start a new master with new code, then QUIT the old one
+    TTIN / TTOU  add / remove one worker
+"""
+import os
+import tempfile
+
+# Workers share one listener, so a scrape reaches a random worker: give them a
+# directory to pool their metrics in (must be set before config is imported)
+if not os.environ.get('NUTRICHECK_METRICS_DIR'):
+    os.environ['NUTRICHECK_METRICS_DIR'] = tempfile.mkdtemp(prefix='nutricheck-metrics-')
+
+from config import (
+    SERVE_BIND, SERVE_WORKERS, SERVE_THREADS, SERVE_MAX_REQUESTS,
+    SERVE_MAX_REQUESTS_JITTER, SERVE_TIMEOUT, SERVE_GRACEFUL_TIMEOUT
+)
+
+bind = f"0.0.0.0:{os.environ['PORT']}" if 'PORT' in os.environ else SERVE_BIND
+workers = int(os.environ.get('WEB_CONCURRENCY', SERVE_WORKERS))
+worker_class = 'gthread'
+threads = SERVE_THREADS
+
+# Load the app (and OCR model) once in the master, then fork
+preload_app = True
+
+# Recycle workers to cap memory growth
+max_requests = SERVE_MAX_REQUESTS
+max_requests_jitter = SERVE_MAX_REQUESTS_JITTER
+
+timeout = SERVE_TIMEOUT
+graceful_timeout = SERVE_GRACEFUL_TIMEOUT
+
+
+def on_starting(server):
+    from services.metrics import clear_metrics_dir
+    clear_metrics_dir()
+
+
+def post_fork(server, worker):
+    # Background threads start here, never in the master: it forks at boot and on
+    # every recycle, and a lock held by one of its threads at fork time would stay
+    # held forever in the child
+    from services.metrics import reset_metrics, start_metrics_flusher
+    from services.ocr_service import configure_worker_threads
+    from services.storage_service import claim_sweeper, start_sweeper
+    # The master's values (and locks) were copied by fork; start clean
+    reset_metrics()
+    start_metrics_flusher()
+    configure_worker_threads()
+    # One worker sweeps storage; a replacement takes over when that worker exits
+    if claim_sweeper():
+        start_sweeper()
+
+
+def worker_exit(server, worker):
+    # Runs in the worker after its last request: record everything it served
+    from services.metrics import flush_metrics
+    flush_metrics()
+
+
+def child_exit(server, worker):
+    # Keep a recycled worker's counters in the totals
+    from services.metrics import archive_process
+    archive_process(worker.pid)
@@ -0,0 +1,109 @@
+"""
+Benchmark the OCR profiles in config.OCR_PROFILES.
+
+Runs both OCR passes of the analysis pipeline (preprocessed + original
+image) over every label image in a folder, once per profile, and reports
+latency and how many of the six nutrients were recovered.
+
+    python loadtest/bench_ocr_profiles.py                     # all profiles, static/uploads
+    python loadtest/bench_ocr_profiles.py --profiles fast,accurate --repeat 3 --json
+
+Needs the real EasyOCR model (NUTRICHECK_OCR_MODE=live).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from config import OCR_PROFILES, ALLOWED_EXTENSIONS  # noqa: E402
+from services.image_processor import preprocess_image, load_image_for_ocr  # noqa: E402
+from services.ocr_service import extract_text, get_reader  # noqa: E402
+from models.nutrient_parser import parse_nutrients  # noqa: E402
+
+
+def bench_profile(profile, images, repeat):
+    latencies = []
+    found = []
+    for path in images:
+        preprocessed = preprocess_image(path)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            first = extract_text(preprocessed, profile)
+            original = load_image_for_ocr(path, OCR_PROFILES[profile]['canvas_size'])
+            second = extract_text(original, profile)
+            latencies.append(time.perf_counter() - start)
+
+        nutrients = parse_nutrients(first['full_text'])
+        for key, val in parse_nutrients(second['full_text']).items():
+            if nutrients.get(key) is None and val is not None:
+                nutrients[key] = val
+        found.append(sum(v is not None for v in nutrients.values()))
+
+    latencies.sort()
+    return {
+        'images': len(images),
+        'mean_s': statistics.mean(latencies),
+        'p50_s': statistics.median(latencies),
+        'max_s': latencies[-1],
+        'nutrients_found': sum(found),
+        'nutrients_possible': 6 * len(images),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark OCR speed/accuracy profiles.')
+    parser.add_argument('--images', default=os.path.join(BASE_DIR, 'static', 'uploads'))
+    parser.add_argument('--profiles', default=','.join(OCR_PROFILES),
+                        help='Comma-separated profile names.')
+    parser.add_argument('--repeat', type=int, default=1, help='Timed runs per image.')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+    parser.add_argument('--markdown', action='store_true',
+                        help='Print a results table for docs/architecture.md.')
+    args = parser.parse_args(argv)
+
+    images = sorted(os.path.join(args.images, f) for f in os.listdir(args.images)
+                    if f.rsplit('.', 1)[-1].lower() in ALLOWED_EXTENSIONS)
+    if not images:
+        parser.error(f'No images found in {args.images}')
+
+    start = time.perf_counter()
+    get_reader()
+    print(f"Reader loaded in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    # Warm-up so the first profile does not pay one-off allocation costs
+    extract_text(images[0])
+
+    results = {name: bench_profile(name, images, args.repeat)
+               for name in args.profiles.split(',')}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    if args.markdown:
+        import torch
+        print(f"Measured on {platform.processor() or platform.machine()}, {os.cpu_count()} CPUs, "
+              f"torch {torch.__version__} with {torch.get_num_threads()} threads, "
+              f"{len(images)} images x {args.repeat}:\n")
+        print("| Profile | Mean s | p50 s | Max s | Nutrients found |")
+        print("|---------|--------|-------|-------|-----------------|")
+        for name, r in results.items():
+            print(f"| `{name}` | {r['mean_s']:.2f} | {r['p50_s']:.2f} | {r['max_s']:.2f} "
+                  f"| {r['nutrients_found']}/{r['nutrients_possible']} |")
+        return 0
+
+    print(f"{'profile':<10} {'images':>6} {'mean s':>8} {'p50 s':>8} {'max s':>8} {'nutrients':>10}")
+    for name, r in results.items():
+        print(f"{name:<10} {r['images']:>6} {r['mean_s']:>8.2f} {r['p50_s']:>8.2f} {r['max_s']:>8.2f} "
+              f"{r['nutrients_found']:>4}/{r['nutrients_possible']:<5}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
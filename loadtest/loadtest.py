@@ -0,0 +1,301 @@
+"""
+NutriCheck HTTP load generator.
+
+Replays the label images in static/uploads against the API and reports
+throughput, latency percentiles and error rates per endpoint.
+
+    # closed loop: 8 clients issuing requests back to back for 60 s
+    python loadtest/loadtest.py --url http://localhost:8000 --concurrency 8 --duration 60
+
+    # open loop: Poisson arrivals at 20 req/s (latency includes queueing delay)
+    python loadtest/loadtest.py --rate 20 --duration 60 --mix history=6,compare=2,report=2
+
+To load the web, database and PDF layers without the OCR model, start the
+server with recorded OCR results instead of EasyOCR:
+
+    NUTRICHECK_OCR_MODE=record python app.py   # once, with the model, to record
+    NUTRICHECK_OCR_MODE=replay gunicorn -c gunicorn.conf.py wsgi:app
+
+Only the standard library is used so it runs from any machine.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+import mimetypes
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_IMAGES = os.path.join(BASE_DIR, 'static', 'uploads')
+DEFAULT_MIX = 'analyze=1,history=4,compare=2,report=3'
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp')
+
+
+class Stats:
+    """Thread-safe latency and error collector, per operation."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.status_codes = defaultdict(lambda: defaultdict(int))
+
+    def add(self, op, seconds, status, ok):
+        with self._lock:
+            self.latencies[op].append(seconds)
+            self.status_codes[op][status] += 1
+            if not ok:
+                self.errors[op] += 1
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation '{name}'. Use: {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Client:
+    """Issues API requests and tracks the analysis IDs it can reference."""
+
+    def __init__(self, base_url, images, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.images = images
+        self.timeout = timeout
+        self.ids = []
+        self._id_set = set()   # mirrors ids: membership checks stay O(1) inside timed calls
+        self._ids_lock = threading.Lock()
+
+    def _request(self, method, path, body=None, headers=None):
+        req = urllib.request.Request(self.base_url + path, data=body, method=method,
+                                     headers=headers or {})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def _remember(self, ids):
+        with self._ids_lock:
+            for i in ids:
+                if i not in self._id_set:
+                    self._id_set.add(i)
+                    self.ids.append(i)
+
+    def _forget(self, analysis_id):
+        with self._ids_lock:
+            if analysis_id in self._id_set:
+                self._id_set.discard(analysis_id)
+                self.ids.remove(analysis_id)
+
+    def sample_ids(self, k):
+        with self._ids_lock:
+            if len(self.ids) < k:
+                return None
+            return random.sample(self.ids, k)
+
+    def analyze(self):
+        path = random.choice(self.images)
+        boundary = uuid.uuid4().hex
+        with open(path, 'rb') as f:
+            content = f.read()
+        ctype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        body = (
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="image"; filename="{os.path.basename(path)}"\r\n'
+            f'Content-Type: {ctype}\r\n\r\n'
+        ).encode('utf-8') + content + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+        status, data = self._request('POST', '/api/analyze', body,
+                                     {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        if status == 200:
+            self._remember([json.loads(data)['id']])
+        return status
+
+    def history(self):
+        status, data = self._request('GET', '/api/history')
+        if status == 200:
+            self._remember([a['id'] for a in json.loads(data)])
+        return status
+
+    def compare(self):
+        ids = self.sample_ids(random.randint(2, 4)) or self.sample_ids(2)
+        if not ids:
+            return 'history', self.history()
+        return self._request('POST', '/api/compare', json.dumps({'ids': ids}).encode('utf-8'),
+                             {'Content-Type': 'application/json'})[0]
+
+    def report(self):
+        ids = self.sample_ids(1)
+        if not ids:
+            return 'history', self.history()
+        status, _ = self._request('GET', f'/api/report/{ids[0]}')
+        if status == 404:
+            self._forget(ids[0])
+        return status
+
+
+# Operations return an HTTP status, or (operation actually run, status) when
+# they had to substitute another (compare/report fetch history until IDs exist)
+OPERATIONS = {
+    'analyze': Client.analyze,
+    'history': Client.history,
+    'compare': Client.compare,
+    'report': Client.report,
+}
+
+
+def run_one(client, stats, op, scheduled_at=None):
+    start = time.perf_counter()
+    try:
+        status = OPERATIONS[op](client)
+        if isinstance(status, tuple):
+            op, status = status
+        ok = 200 <= status < 400
+    except Exception as e:
+        status, ok = type(e).__name__, False
+    # Open loop measures from the scheduled arrival, so queueing delay is not hidden
+    began = scheduled_at if scheduled_at is not None else start
+    stats.add(op, time.perf_counter() - began, status, ok)
+
+
+def run_closed_loop(client, stats, mix, concurrency, deadline, max_requests):
+    ops, weights = zip(*mix.items())
+    issued = [0]
+    lock = threading.Lock()
+
+    def worker():
+        while time.perf_counter() < deadline:
+            with lock:
+                if max_requests and issued[0] >= max_requests:
+                    return
+                issued[0] += 1
+            run_one(client, stats, random.choices(ops, weights)[0])
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def run_open_loop(client, stats, mix, rate, concurrency, deadline, max_requests):
+    ops, weights = zip(*mix.items())
+    issued = 0
+    next_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while next_at < deadline and not (max_requests and issued >= max_requests):
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(run_one, client, stats, random.choices(ops, weights)[0], next_at)
+            issued += 1
+            next_at += random.expovariate(rate)
+
+
+def report(stats, elapsed, as_json):
+    summary = {}
+    all_latencies = []
+    for op in sorted(stats.latencies):
+        lat = sorted(stats.latencies[op])
+        all_latencies.extend(lat)
+        summary[op] = {
+            'requests': len(lat),
+            'errors': stats.errors[op],
+            'error_rate': stats.errors[op] / len(lat),
+            'throughput_rps': len(lat) / elapsed,
+            'p50_ms': percentile(lat, 50) * 1000,
+            'p95_ms': percentile(lat, 95) * 1000,
+            'p99_ms': percentile(lat, 99) * 1000,
+            'max_ms': lat[-1] * 1000,
+            'status_codes': {str(k): v for k, v in stats.status_codes[op].items()},
+        }
+    all_latencies.sort()
+    total_errors = sum(stats.errors.values())
+    summary['total'] = {
+        'requests': len(all_latencies),
+        'errors': total_errors,
+        'error_rate': total_errors / len(all_latencies) if all_latencies else 0.0,
+        'throughput_rps': len(all_latencies) / elapsed,
+        'p50_ms': percentile(all_latencies, 50) * 1000,
+        'p95_ms': percentile(all_latencies, 95) * 1000,
+        'p99_ms': percentile(all_latencies, 99) * 1000,
+        'max_ms': (all_latencies[-1] * 1000) if all_latencies else 0.0,
+        'elapsed_s': elapsed,
+    }
+
+    if as_json:
+        print(json.dumps(summary, indent=2))
+        return summary
+
+    header = f"{'operation':<10} {'reqs':>7} {'err%':>6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    print(header)
+    print('-' * len(header))
+    for op, row in summary.items():
+        print(f"{op:<10} {row['requests']:>7} {row['error_rate'] * 100:>5.1f}% {row['throughput_rps']:>8.2f} "
+              f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['max_ms']:>9.1f}")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load-test the NutriCheck HTTP API.')
+    parser.add_argument('--url', default='http://localhost:5000', help='Server base URL.')
+    parser.add_argument('--images', default=DEFAULT_IMAGES, help='Directory of label images to upload.')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'Weighted operation mix (default: {DEFAULT_MIX}).')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Closed loop: number of clients. Open loop: max in-flight requests.')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='Open loop arrival rate in requests/second (Poisson).')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to run.')
+    parser.add_argument('--requests', type=int, default=0, help='Stop after this many requests.')
+    parser.add_argument('--timeout', type=float, default=120, help='Per-request timeout (s).')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for repeatable runs.')
+    parser.add_argument('--json', action='store_true', help='Print the summary as JSON.')
+    args = parser.parse_args(argv)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    images = sorted(os.path.join(args.images, f) for f in os.listdir(args.images)
+                    if f.lower().endswith(IMAGE_EXTENSIONS))
+    if not images and 'analyze' in args.mix:
+        parser.error(f'No images found in {args.images}')
+
+    client = Client(args.url, images, args.timeout)
+    client.history()  # seed known IDs
+    stats = Stats()
+
+    start = time.perf_counter()
+    deadline = start + args.duration
+    if args.rate:
+        run_open_loop(client, stats, args.mix, args.rate, args.concurrency, deadline, args.requests)
+    else:
+        run_closed_loop(client, stats, args.mix, args.concurrency, deadline, args.requests)
+    elapsed = time.perf_counter() - start
+
+    summary = report(stats, elapsed, args.json)
+    return 1 if summary['total']['requests'] == 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
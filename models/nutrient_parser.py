@@ -30,6 +30,87 @@ NUTRIENT_PATTERNS = {
     ],
 }
 
+# Label keywords for other locales, per nutrient. 'salt' is converted to
+# sodium when a label gives no sodium line (EU labels declare salt in g).
+LOCALE_KEYWORDS = {
+    'fr': {
+        'calories': ['valeur énergétique', 'valeur energetique', 'énergie', 'energie'],
+        'sugar': ['dont sucres', 'sucres', 'sucre'],
+        'fat': ['matières grasses', 'matieres grasses', 'lipides'],
+        'sodium': ['sodium'],
+        'salt': ['sel'],
+        'protein': ['protéines', 'proteines'],
+        'fiber': ['fibres alimentaires', 'fibres'],
+    },
+    'de': {
+        'calories': ['brennwert', 'energie'],
+        'sugar': ['davon zucker', 'zucker'],
+        'fat': ['fett'],
+        'sodium': ['natrium'],
+        'salt': ['salz'],
+        'protein': ['eiweiß', 'eiweiss', 'protein'],
+        'fiber': ['ballaststoffe'],
+    },
+    'es': {
+        'calories': ['valor energético', 'valor energetico', 'energía', 'energia'],
+        'sugar': ['azúcares', 'azucares'],
+        'fat': ['grasas', 'grasa'],
+        'sodium': ['sodio'],
+        'salt': ['sal'],
+        'protein': ['proteínas', 'proteinas'],
+        'fiber': ['fibra alimentaria', 'fibra'],
+    },
+    'it': {
+        'calories': ['valore energetico', 'energia'],
+        'sugar': ['zuccheri'],
+        'fat': ['grassi'],
+        'sodium': ['sodio'],
+        'salt': ['sale'],
+        'protein': ['proteine'],
+        'fiber': ['fibre', 'fibra'],
+    },
+}
+
+# Words that mark a line as label text rather than the product name, per locale
+LOCALE_LABEL_WORDS = {
+    'en': {
+        'calories', 'sugar', 'fat', 'sodium', 'protein', 'fiber',
+        'nutrition', 'facts', 'amount', 'serving', 'daily', 'value',
+        'total', 'percent', 'ingredients', 'contains', 'allergen',
+        'carbohydrate', 'cholesterol', 'vitamin', 'mineral', 'energy'
+    },
+    'fr': {'valeurs', 'nutritionnelles', 'énergie', 'glucides', 'lipides', 'sucres',
+           'protéines', 'sel', 'fibres', 'ingrédients', 'portion', 'dont'},
+    'de': {'nährwerte', 'nährwertangaben', 'brennwert', 'fett', 'kohlenhydrate', 'zucker',
+           'eiweiß', 'salz', 'ballaststoffe', 'zutaten', 'davon', 'portion'},
+    'es': {'información', 'nutricional', 'valor', 'energético', 'grasas', 'hidratos',
+           'azúcares', 'proteínas', 'sal', 'fibra', 'ingredientes', 'porción'},
+    'it': {'valori', 'nutrizionali', 'energia', 'grassi', 'carboidrati', 'zuccheri',
+           'proteine', 'sale', 'fibre', 'ingredienti', 'porzione'},
+}
+
+
+def _keyword_regex(keywords):
+    # parse_nutrients maps every 'o' to '0' before matching
+    return '|'.join(re.escape(kw).replace('o', '[o0]') for kw in keywords)
+
+
+def _locale_patterns(keywords):
+    """Build NUTRIENT_PATTERNS-style regexes from a locale keyword table."""
+    value = r'(\d+(?:[.,]\d+)?)'
+    patterns = {}
+    for nutrient, words in keywords.items():
+        alternatives = _keyword_regex(words)
+        patterns[nutrient] = [
+            rf'(?:{alternatives})[:\s]*{value}\s*(?:kj|kcal|mg|g)?',
+            rf'{value}\s*(?:mg|g)\s*(?:{alternatives})',
+        ]
+    return patterns
+
+
+LOCALE_PATTERNS = {'en': NUTRIENT_PATTERNS}
+LOCALE_PATTERNS.update({locale: _locale_patterns(kw) for locale, kw in LOCALE_KEYWORDS.items()})
+
 # Unit conversion multipliers → normalize to standard units
 # calories: kcal, sugar/fat/protein/fiber: g, sodium: mg
 UNIT_CONVERSIONS = {
@@ -46,16 +127,28 @@ UNIT_CONVERSIONS = {
 }
 
 
-def parse_nutrients(ocr_text):
+def detect_locale(ocr_text):
+    """Guess a label's locale from which keyword table matches the most words."""
+    words = set(re.findall(r'\w+', ocr_text.lower()))
+    hits = {locale: len(words & vocab) for locale, vocab in LOCALE_LABEL_WORDS.items()}
+    best = max(hits, key=hits.get)
+    return best if hits[best] > hits['en'] else 'en'
+
+
+def parse_nutrients(ocr_text, locales=None):
     """
     Parse OCR text to extract nutrient values.
     
     Args:
         ocr_text: string of OCR-detected text
+        locales: keyword tables to try, in order (default: detected locale, then 'en')
     
     Returns:
         dict with nutrient keys and float values (or None if not found)
     """
+    if not locales:
+        locales = [detect_locale(ocr_text)]
+    locales = [loc for loc in dict.fromkeys(list(locales) + ['en']) if loc in LOCALE_PATTERNS]
     text = ocr_text.lower()
     
     # Fix common OCR misreads
@@ -71,18 +164,25 @@ def parse_nutrients(ocr_text):
 
     nutrients = {}
 
-    for nutrient, patterns in NUTRIENT_PATTERNS.items():
+    for nutrient in list(NUTRIENT_PATTERNS) + ['salt']:
         value = None
+        patterns = [p for loc in locales for p in LOCALE_PATTERNS[loc].get(nutrient, [])]
         for pattern in patterns:
             match = re.search(pattern, text)
             if match:
                 try:
-                    value = float(match.group(1))
+                    # Decimal commas are common outside English labels
+                    value = float(match.group(1).replace(',', '.'))
                     break
                 except (ValueError, IndexError):
                     continue
         nutrients[nutrient] = value
 
+    # Salt (g) → sodium (mg): salt is 40% sodium
+    salt = nutrients.pop('salt')
+    if nutrients['sodium'] is None and salt is not None:
+        nutrients['sodium'] = salt * 400
+
     # Apply unit conversions where needed
     nutrients = normalize_units(nutrients, text)
 
@@ -123,17 +223,16 @@ def sanity_check(nutrients):
     return nutrients
 
 
-def extract_product_name(ocr_texts):
+def extract_product_name(ocr_texts, locales=None):
     """
     Attempt to extract a product name from OCR text lines.
     Heuristic: first non-nutrient text line that is 3+ characters.
     """
-    nutrient_keywords = {
-        'calories', 'sugar', 'fat', 'sodium', 'protein', 'fiber',
-        'nutrition', 'facts', 'amount', 'serving', 'daily', 'value',
-        'total', 'percent', 'ingredients', 'contains', 'allergen',
-        'carbohydrate', 'cholesterol', 'vitamin', 'mineral', 'energy'
-    }
+    if not locales:
+        locales = [detect_locale('\n'.join(ocr_texts))]
+    nutrient_keywords = set(LOCALE_LABEL_WORDS['en'])
+    for locale in locales:
+        nutrient_keywords |= LOCALE_LABEL_WORDS.get(locale, set())
 
     for text in ocr_texts:
         cleaned = text.strip()
@@ -1,45 +1,93 @@
-import os
-from services.image_processor import preprocess_image
-from services.ocr_service import extract_text
-from models.nutrient_parser import parse_nutrients, extract_product_name
+from services.image_processor import (
+    preprocess_image, load_image_for_ocr, analysis_memory_estimate, image_budget
+)
+from services.ocr_service import extract_text, get_profile
+from models.nutrient_parser import parse_nutrients, extract_product_name, detect_locale
 from models.health_scorer import calculate_health_score
 from database import save_analysis
+from services.metrics import stage_timer
 
 
-def analyze_image(image_path):
+def analyze_image(image_path, ocr_profile=None, languages=None):
     """
     Full analysis pipeline: preprocess → OCR → parse → score → save.
     
     Args:
         image_path: path to the uploaded image file
+        ocr_profile: OCR speed/accuracy profile name (see OCR_PROFILES)
+        languages: OCR language hint, e.g. ['de'] (default: OCR_LANGUAGES,
+                   with the label locale detected from the text)
     
     Returns:
         dict with all analysis results and the database row ID
     """
-    # Step 1: Preprocess image for OCR
-    preprocessed = preprocess_image(image_path)
+    result = None
+    for event, data in iter_analysis(image_path, ocr_profile, languages):
+        if event == 'result':
+            result = data
+    return result
+
+
+def iter_analysis(image_path, ocr_profile=None, languages=None):
+    """
+    Run the analysis pipeline, yielding (event, data) tuples as it goes:
+
+        ('stage', {'stage': name})   after each stage completes:
+                                     preprocess, ocr_pass_1, ocr_pass_2,
+                                     parse, score, saved
+        ('partial', {...})           results available before the end
+                                     (nutrients + product name, then score)
+        ('result', result)           the final result dict (last event)
+    """
+    # The original-image pass needs no more pixels than the detector's canvas
+    ocr_max_side = get_profile(ocr_profile)['canvas_size']
+    # Image arrays for both OCR passes count against the per-process budget
+    with image_budget.reserve(analysis_memory_estimate(image_path, ocr_max_side)):
+        # Step 1: Preprocess image for OCR
+        with stage_timer('preprocess'):
+            preprocessed = preprocess_image(image_path)
+        yield 'stage', {'stage': 'preprocess'}
 
-    # Step 2: Run OCR on preprocessed image
-    ocr_result = extract_text(preprocessed)
+        # Step 2: Run OCR on preprocessed image
+        with stage_timer('ocr_preprocessed'):
+            ocr_result = extract_text(preprocessed, ocr_profile, languages)
+        del preprocessed
+        yield 'stage', {'stage': 'ocr_pass_1'}
 
-    # Also run OCR on original for product name detection
-    original_ocr = extract_text(image_path)
+        # Also run OCR on original for product name detection
+        with stage_timer('ocr_original'):
+            original = load_image_for_ocr(image_path, ocr_max_side)
+            original_ocr = extract_text(original, ocr_profile, languages)
+        del original
+        yield 'stage', {'stage': 'ocr_pass_2'}
 
     # Step 3: Parse nutrients from OCR text
     # Try preprocessed first, fall back to original
-    nutrients = parse_nutrients(ocr_result['full_text'])
+    with stage_timer('parse'):
+        # Keyword tables: the hinted languages, else detected from the label text
+        locales = list(languages) if languages else [detect_locale(original_ocr['full_text'])]
+        nutrients = parse_nutrients(ocr_result['full_text'], locales)
 
-    # If preprocessed missed some, try original image OCR
-    original_nutrients = parse_nutrients(original_ocr['full_text'])
-    for key, val in original_nutrients.items():
-        if nutrients.get(key) is None and val is not None:
-            nutrients[key] = val
+        # If preprocessed missed some, try original image OCR
+        original_nutrients = parse_nutrients(original_ocr['full_text'], locales)
+        for key, val in original_nutrients.items():
+            if nutrients.get(key) is None and val is not None:
+                nutrients[key] = val
 
-    # Step 4: Extract product name
-    product_name = extract_product_name(original_ocr['texts'])
+        # Step 4: Extract product name
+        product_name = extract_product_name(original_ocr['texts'], locales)
+    yield 'stage', {'stage': 'parse'}
+    yield 'partial', {'product_name': product_name, 'nutrients': dict(nutrients)}
 
     # Step 5: Calculate health score
-    health_result = calculate_health_score(nutrients)
+    with stage_timer('score'):
+        health_result = calculate_health_score(nutrients)
+    yield 'stage', {'stage': 'score'}
+    yield 'partial', {
+        'health_score': health_result['health_score'],
+        'verdict': health_result['verdict'],
+        'explanation': health_result['explanation'],
+    }
 
     # Step 6: Build result object
     result = {
@@ -60,7 +108,9 @@ def analyze_image(image_path):
     }
 
     # Step 7: Save to database
-    row_id = save_analysis(result)
+    with stage_timer('save'):
+        row_id = save_analysis(result)
     result['id'] = row_id
+    yield 'stage', {'stage': 'saved', 'id': row_id}
 
-    return result
+    yield 'result', result
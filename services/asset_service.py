@@ -0,0 +1,147 @@
+import os
+import json
+import gzip
+import hashlib
+import logging
+import mimetypes
+import threading
+from flask import request, send_file, abort
+from config import (
+    BASE_DIR, ASSET_SOURCES, ASSET_DIST_FOLDER, ASSET_CACHE_MAX_AGE,
+    ASSET_GZIP_LEVEL, ASSET_BROTLI_QUALITY
+)
+from services.file_utils import write_atomic
+
+try:
+    import brotli
+except ImportError:  # optional: gzip alone still works
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+STATIC_FOLDER = os.path.join(BASE_DIR, 'static')
+MANIFEST_PATH = os.path.join(ASSET_DIST_FOLDER, 'manifest.json')
+
+# Precompressed variants, preferred first: (Accept-Encoding token, file suffix)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def _fingerprinted_name(source, content):
+    root, ext = os.path.splitext(source)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:12]}{ext}"
+
+
+def _variant_source(name):
+    """Strip a compression suffix: 'js/app.<hash>.js.gz' -> 'js/app.<hash>.js'."""
+    for _, suffix in ENCODINGS:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def build_assets():
+    """
+    Copy ASSET_SOURCES into static/dist under content-hashed names, with
+    gzip (and brotli, if installed) variants, and write the manifest.
+    Only this build's and the previous build's files are kept, so pages
+    cached before a deploy can still load their assets.
+
+    Returns:
+        the new manifest {source: fingerprinted name}
+    """
+    global _manifest
+    previous = load_manifest()
+    manifest = {}
+    for source in ASSET_SOURCES:
+        with open(os.path.join(STATIC_FOLDER, source), 'rb') as f:
+            content = f.read()
+        name = _fingerprinted_name(source, content)
+        manifest[source] = name
+        path = os.path.join(ASSET_DIST_FOLDER, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Files already present are from an earlier build of the same content
+        if not os.path.exists(path + '.gz'):
+            write_atomic(path + '.gz', gzip.compress(content, ASSET_GZIP_LEVEL, mtime=0))
+        if brotli is not None and not os.path.exists(path + '.br'):
+            write_atomic(path + '.br', brotli.compress(content, quality=ASSET_BROTLI_QUALITY))
+        # Written last: its presence marks the asset as servable
+        if not os.path.exists(path):
+            write_atomic(path, content)
+
+    if brotli is None:
+        logger.warning("brotli not installed; serving gzip-compressed assets only")
+
+    keep = set(manifest.values()) | set(previous.values()) | {'manifest.json'}
+    for dirpath, _, filenames in os.walk(ASSET_DIST_FOLDER):
+        for filename in filenames:
+            rel = os.path.relpath(os.path.join(dirpath, filename), ASSET_DIST_FOLDER)
+            if _variant_source(rel.replace(os.sep, '/')) not in keep:
+                os.remove(os.path.join(dirpath, filename))
+
+    os.makedirs(ASSET_DIST_FOLDER, exist_ok=True)
+    write_atomic(MANIFEST_PATH, json.dumps(manifest, indent=2).encode('utf-8'))
+    with _manifest_lock:
+        _manifest = manifest
+    return manifest
+
+
+def load_manifest():
+    """The current build's manifest ({} if assets were never built)."""
+    global _manifest
+    with _manifest_lock:
+        if _manifest is None:
+            try:
+                with open(MANIFEST_PATH, encoding='utf-8') as f:
+                    _manifest = json.load(f)
+            except (OSError, ValueError):
+                _manifest = {}
+        return _manifest
+
+
+def serve_sources():
+    """Link the unbuilt /static sources from now on (the build could not be written)."""
+    global _manifest
+    with _manifest_lock:
+        _manifest = {}
+
+
+def asset_url(source, use_build=True):
+    """URL of a static asset: the fingerprinted build if present, else the source file."""
+    name = load_manifest().get(source) if use_build else None
+    if name:
+        return '/assets/' + name
+    return '/static/' + source
+
+
+def _negotiate(path):
+    """Pick the best precompressed variant the client accepts: (path, encoding or None)."""
+    for encoding, suffix in ENCODINGS:
+        if request.accept_encodings[encoding] and os.path.isfile(path + suffix):
+            return path + suffix, encoding
+    return path, None
+
+
+def send_asset(filename):
+    """Serve a fingerprinted asset with immutable caching and Accept-Encoding negotiation."""
+    if filename.endswith(('.gz', '.br', '.tmp')) or filename == 'manifest.json':
+        abort(404)
+    path = os.path.abspath(os.path.join(ASSET_DIST_FOLDER, filename))
+    if not path.startswith(os.path.abspath(ASSET_DIST_FOLDER) + os.sep) or not os.path.isfile(path):
+        abort(404)
+
+    served_path, encoding = _negotiate(path)
+    response = send_file(
+        served_path,
+        mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+        conditional=True,
+        max_age=ASSET_CACHE_MAX_AGE,
+    )
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_path(path):
+    """
+    Yield a private temp path in path's directory; when the block succeeds
+    it replaces `path` in one step. Concurrent writers of the same file each
+    get their own temp file, and readers never see a partial one. Temp names
+    end in '.tmp', so storage sweeps remove any left by a crash.
+    """
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    os.close(fd)
+    try:
+        # mkstemp creates 0600; these files are served or read by other processes
+        os.chmod(tmp_path, 0o644)
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def write_atomic(path, data):
+    """Write bytes (or UTF-8 text) to path atomically."""
+    with atomic_path(path) as tmp_path:
+        if isinstance(data, str):
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+        else:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+
+
+def copy_atomic(src, dst):
+    """Copy a file's contents to dst atomically."""
+    with atomic_path(dst) as tmp_path:
+        shutil.copyfile(src, tmp_path)
@@ -1,6 +1,170 @@
+import threading
+from contextlib import contextmanager
 import cv2
 import numpy as np
-from config import IMG_MAX_WIDTH, IMG_MAX_HEIGHT
+from PIL import Image
+from config import (
+    IMG_MAX_WIDTH, IMG_MAX_HEIGHT, IMAGE_MAX_PIXELS,
+    IMAGE_MEMORY_BUDGET_BYTES, IMAGE_MEMORY_WAIT_SECONDS
+)
+from services.metrics import register_queue_gauge
+
+# cv2.imread flags that decode at 1/2, 1/4 or 1/8 scale; only used for JPEG (DCT scaling)
+_REDUCED_FLAGS = {
+    False: ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+            (2, cv2.IMREAD_REDUCED_COLOR_2), (1, cv2.IMREAD_COLOR)),
+    True: ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8), (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+           (2, cv2.IMREAD_REDUCED_GRAYSCALE_2), (1, cv2.IMREAD_GRAYSCALE)),
+}
+
+
+class ImageMemoryError(MemoryError):
+    """Raised when the per-process image memory budget stays exhausted."""
+
+
+class ImageRejectedError(ValueError):
+    """Raised for an image that will not be decoded: its header is unreadable."""
+    status_code = 400
+
+
+class ImageTooLargeError(ImageRejectedError):
+    """Raised for an image over IMAGE_MAX_PIXELS, decompression bombs included."""
+    status_code = 413
+
+
+class ImageMemoryBudget:
+    """
+    Caps the decoded-image bytes held by concurrent requests in one process.
+    A reservation larger than the whole budget is clamped, so it runs alone.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def reserve(self, nbytes, timeout=IMAGE_MEMORY_WAIT_SECONDS):
+        nbytes = min(int(nbytes), self.limit)
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.used + nbytes <= self.limit, timeout):
+                raise ImageMemoryError("Server is busy processing other images, try again shortly")
+            self.used += nbytes
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.used -= nbytes
+                self._cond.notify_all()
+
+
+image_budget = ImageMemoryBudget(IMAGE_MEMORY_BUDGET_BYTES)
+
+register_queue_gauge(
+    'nutricheck_image_memory_reserved_bytes', 'Decoded-image bytes reserved by in-flight work.',
+    lambda: image_budget.used)
+
+
+# PIL refuses headers over twice this (DecompressionBombError); keep it in step with ours
+Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+
+
+def _read_header(image_path):
+    """
+    (width, height) and PIL format name from the file header, without
+    decoding pixels. None if unreadable; ImageTooLargeError for a
+    decompression bomb.
+    """
+    try:
+        with Image.open(image_path) as im:
+            return im.size, im.format
+    except Image.DecompressionBombError:
+        raise ImageTooLargeError(f"Image too large: over {IMAGE_MAX_PIXELS} pixels")
+    except Exception:
+        return None
+
+
+def read_image_size(image_path):
+    """
+    Image (width, height) from the file header, without decoding pixels.
+    Returns None if the header is unreadable; raises ImageTooLargeError for
+    a decompression bomb.
+    """
+    header = _read_header(image_path)
+    return header[0] if header else None
+
+
+def _checked_header(image_path):
+    """Header (size, format) of an image that is safe to decode; ImageRejectedError otherwise."""
+    header = _read_header(image_path)
+    if header is None:
+        raise ImageRejectedError("Could not read image: unsupported or corrupt file")
+    size = header[0]
+    if size[0] * size[1] > IMAGE_MAX_PIXELS:
+        raise ImageTooLargeError(f"Image too large: {size[0]}x{size[1]} pixels "
+                                 f"(limit {IMAGE_MAX_PIXELS} pixels)")
+    return header
+
+
+def _target_scale(size, max_width, max_height):
+    """Downscale factor resize_image will apply (<= 1), for either EXIF orientation."""
+    w, h = size
+    return min(1.0, max(min(max_width / w, max_height / h), min(max_width / h, max_height / w)))
+
+
+def decode_estimate(image_path, max_width, max_height, channels=3):
+    """
+    Approximate bytes of the decoded + resized arrays for load_image().
+    Raises ImageRejectedError when load_image() would refuse the image.
+    """
+    size, fmt = _checked_header(image_path)
+    factor = _reduction_factor(size, fmt, max_width, max_height)
+    decoded = (size[0] // factor) * (size[1] // factor) * channels
+    scale = _target_scale(size, max_width, max_height)
+    resized = int(size[0] * scale) * int(size[1] * scale) * channels
+    return decoded + resized
+
+
+def _reduction_factor(size, fmt, max_width, max_height):
+    """
+    Largest decoder reduction (8/4/2/1) that still leaves >= the target size.
+    Only libjpeg reduces in the DCT domain; for other formats OpenCV would
+    decode at full size and then subsample coarsely, so they get 1.
+    """
+    if fmt != 'JPEG':
+        return 1
+    scale = _target_scale(size, max_width, max_height)
+    for factor in (8, 4, 2):
+        if scale * factor <= 1.0:
+            return factor
+    return 1
+
+
+def load_image(image_path, max_width, max_height, grayscale=False):
+    """
+    Decode an image no larger than needed for max_width x max_height.
+
+    The reduction factor is picked from the header size so JPEGs are
+    decoded at 1/2, 1/4 or 1/8 scale by libjpeg; other formats are decoded
+    in full. The remainder is an INTER_AREA resize. Nothing is decoded
+    unless the header gives a size within IMAGE_MAX_PIXELS
+    (ImageRejectedError otherwise); returns None if the pixels cannot be
+    decoded.
+    """
+    size, fmt = _checked_header(image_path)
+    factor = _reduction_factor(size, fmt, max_width, max_height)
+    flag = dict(_REDUCED_FLAGS[grayscale])[factor]
+    img = cv2.imread(image_path, flag)
+    if img is None:
+        return None
+    return resize_image(img, max_width, max_height)
+
+
+def analysis_memory_estimate(image_path, ocr_max_side):
+    """Peak image bytes held while one image goes through the analysis pipeline."""
+    # preprocess keeps ~3 grayscale arrays alive; the original OCR pass one colour array
+    return (3 * decode_estimate(image_path, IMG_MAX_WIDTH, IMG_MAX_HEIGHT, channels=1)
+            + decode_estimate(image_path, ocr_max_side, ocr_max_side))
 
 
 def preprocess_image(image_path):
@@ -9,27 +173,22 @@ def preprocess_image(image_path):
     Steps: Resize → Grayscale → CLAHE → Denoise → Adaptive Threshold
     Returns the preprocessed image (numpy array).
     """
-    # Read image
-    img = cv2.imread(image_path)
-    if img is None:
-        raise ValueError(f"Could not read image: {image_path}")
-
-    # Step 1: Resize while maintaining aspect ratio
-    img = resize_image(img, IMG_MAX_WIDTH, IMG_MAX_HEIGHT)
-
-    # Step 2: Convert to grayscale
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    # Steps 1-2: Decode straight to grayscale at (close to) the working size
+    gray = load_image(image_path, IMG_MAX_WIDTH, IMG_MAX_HEIGHT, grayscale=True)
+    if gray is None:
+        raise ImageRejectedError("Could not read image: unsupported or corrupt file")
 
     # Step 3: CLAHE (Contrast Limited Adaptive Histogram Equalization)
     clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
     enhanced = clahe.apply(gray)
+    del gray
 
-    # Step 4: Gaussian denoise
-    denoised = cv2.GaussianBlur(enhanced, (3, 3), 0)
+    # Step 4: Gaussian denoise (in place)
+    cv2.GaussianBlur(enhanced, (3, 3), 0, dst=enhanced)
 
     # Step 5: Adaptive threshold for binarization
     thresh = cv2.adaptiveThreshold(
-        denoised, 255,
+        enhanced, 255,
         cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
         cv2.THRESH_BINARY,
         blockSize=11,
@@ -39,6 +198,17 @@ def preprocess_image(image_path):
     return thresh
 
 
+def load_image_for_ocr(image_path, max_side):
+    """
+    Colour image for the original-image OCR pass, capped at max_side: the
+    OCR profile's canvas_size, past which EasyOCR's detector downscales anyway.
+    """
+    img = load_image(image_path, max_side, max_side)
+    if img is None:
+        raise ImageRejectedError("Could not read image: unsupported or corrupt file")
+    return img
+
+
 def resize_image(img, max_width, max_height):
     """Resize image to fit within max dimensions, preserving aspect ratio."""
     h, w = img.shape[:2]
@@ -53,7 +223,4 @@ def resize_image(img, max_width, max_height):
 
 def get_image_for_display(image_path):
     """Read and resize original image for PDF/display (keeps color)."""
-    img = cv2.imread(image_path)
-    if img is None:
-        return None
-    return resize_image(img, 600, 800)
+    return load_image(image_path, 600, 800)
@@ -0,0 +1,416 @@
+import os
+import glob
+import json
+import time
+import logging
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+from config import METRICS_MULTIPROC_DIR, METRICS_FLUSH_SECONDS
+from services.file_utils import write_atomic
+
+# Latency buckets (seconds): sub-ms DB calls up to minute-long OCR passes
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = []
+
+logger = logging.getLogger(__name__)
+
+# Per-request span list for the structured timing log (None outside a request)
+_request_spans = contextvars.ContextVar('request_spans', default=None)
+_END = object()
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ''
+    inner = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                     for k, v in pairs)
+    return '{' + inner + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[n] for n in self.labelnames)
+
+    def render(self, aggregated=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples() if aggregated is None else self._samples_from(aggregated))
+        return lines
+
+    def _state(self):
+        """Serializable values for the multiprocess snapshot: [[label values, value], ...]."""
+        with self._lock:
+            return [[list(k), v] for k, v in self._values.items()]
+
+    def reset(self):
+        """
+        Start empty in a freshly forked child. The lock is replaced, not
+        acquired: another parent thread may have held it at fork time.
+        """
+        self._lock = threading.Lock()
+        self._values = {}
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._samples_from(items)
+
+    def _samples_from(self, items):
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+    @staticmethod
+    def merge(total, value):
+        return (total or 0) + value
+
+
+class Gauge(_Metric):
+    """Gauge set directly, or computed at scrape time from a callback."""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        self._callback = callback
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        return self._samples_from([(k, v) for k, v in self._state()], ())
+
+    def _state(self):
+        if self._callback is not None:
+            return [[[], self._callback()]]
+        return super()._state()
+
+    def _samples_from(self, items, extra_names=('pid',)):
+        # Gauges are not summable across processes: one series per live process
+        names = self.labelnames + tuple(extra_names)
+        return [f"{self.name}{_format_labels(names, k)} {_format_value(v)}" for k, v in sorted(items)]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        return self._samples_from(items)
+
+    @staticmethod
+    def merge(total, value):
+        if total is None:
+            return list(value)
+        return [a + b for a, b in zip(total, value)]
+
+    def _state(self):
+        with self._lock:
+            return [[list(k), list(v)] for k, v in self._values.items()]
+
+    def _samples_from(self, items):
+        lines = []
+        for key, state in items:
+            for bound, count in zip(self.buckets, state):
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+def render_metrics():
+    """
+    Prometheus text exposition of every registered metric. With
+    METRICS_MULTIPROC_DIR set, this covers every process of the server,
+    not just the one answering the scrape.
+    """
+    aggregated = _aggregate() if METRICS_MULTIPROC_DIR else {}
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render(aggregated.get(metric.name, []) if METRICS_MULTIPROC_DIR else None))
+    return '\n'.join(lines) + '\n'
+
+
+# --- Multiprocess mode ---
+#
+# Under gunicorn each worker process keeps its own metrics. Every process
+# writes a snapshot to METRICS_MULTIPROC_DIR (on each scrape and every
+# METRICS_FLUSH_SECONDS), and a scrape aggregates all snapshots: counters and
+# histograms are summed, gauges get a `pid` label. When a worker exits, the
+# master folds its counters and histograms into archive.json, so totals never
+# go backwards when workers are recycled. Only workers flush: the master forks
+# and must run no threads that could hold a lock at fork time.
+
+ARCHIVE_NAME = 'archive.json'
+_ARCHIVE_MERGED_KEEP = 1000   # worker snapshot names remembered as already archived
+
+_process_ident = None          # (pid, snapshot file name)
+_flusher_stop = threading.Event()
+
+
+def _snapshot_name():
+    global _process_ident
+    pid = os.getpid()
+    if _process_ident is None or _process_ident[0] != pid:
+        # Start time keeps names unique when the OS reuses a PID
+        _process_ident = (pid, f"worker_{pid}_{time.time_ns()}.json")
+    return _process_ident[1]
+
+
+def _write_json(path, data):
+    write_atomic(path, json.dumps(data))
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def flush_metrics():
+    """Write this process's snapshot to the shared directory."""
+    if not METRICS_MULTIPROC_DIR:
+        return
+    snapshot = {
+        'pid': os.getpid(),
+        'metrics': {m.name: {'kind': m.kind, 'values': m._state()} for m in _registry},
+    }
+    _write_json(os.path.join(METRICS_MULTIPROC_DIR, _snapshot_name()), snapshot)
+
+
+def _fold(totals, metrics, include_gauges, pid=None):
+    kinds = {m.name: m for m in _registry}
+    for name, entry in metrics.items():
+        metric = kinds.get(name)
+        if metric is None:
+            continue
+        target = totals.setdefault(name, {})
+        for key, value in entry['values']:
+            if metric.kind == 'gauge':
+                if include_gauges:
+                    target[tuple(key) + (pid,)] = value
+                continue
+            target[tuple(key)] = metric.merge(target.get(tuple(key)), value)
+
+
+def _aggregate():
+    """{metric name: [(label values, value), ...]} across all processes."""
+    flush_metrics()
+    totals = {}
+    snapshots = []
+    for path in glob.glob(os.path.join(METRICS_MULTIPROC_DIR, 'worker_*.json')):
+        data = _read_json(path)
+        if data is not None:
+            snapshots.append((os.path.basename(path), data))
+    # Read the archive last: a snapshot archived meanwhile is then counted once, from here
+    archive = _read_json(os.path.join(METRICS_MULTIPROC_DIR, ARCHIVE_NAME)) or {'metrics': {}, 'merged': []}
+    merged = set(archive['merged'])
+    _fold(totals, archive['metrics'], include_gauges=False)
+    for name, data in snapshots:
+        if name not in merged:
+            _fold(totals, data['metrics'], include_gauges=True, pid=data['pid'])
+    return {name: sorted(values.items()) for name, values in totals.items()}
+
+
+def archive_process(pid):
+    """
+    Fold an exited process's counters and histograms into the archive and
+    drop its snapshot. Call only from the gunicorn master (single writer).
+    """
+    if not METRICS_MULTIPROC_DIR:
+        return
+    archive_path = os.path.join(METRICS_MULTIPROC_DIR, ARCHIVE_NAME)
+    for path in glob.glob(os.path.join(METRICS_MULTIPROC_DIR, f'worker_{pid}_*.json')):
+        data = _read_json(path)
+        archive = _read_json(archive_path) or {'metrics': {}, 'merged': []}
+        if data is not None:
+            totals = {name: {tuple(k): v for k, v in entry['values']}
+                      for name, entry in archive['metrics'].items()}
+            _fold(totals, data['metrics'], include_gauges=False)
+            archive['metrics'] = {name: {'values': [[list(k), v] for k, v in values.items()]}
+                                  for name, values in totals.items()}
+            archive['merged'] = (archive['merged'] + [os.path.basename(path)])[-_ARCHIVE_MERGED_KEEP:]
+            _write_json(archive_path, archive)
+        os.remove(path)
+
+
+def clear_metrics_dir():
+    """Remove snapshots left by a previous server run."""
+    if not METRICS_MULTIPROC_DIR:
+        return
+    os.makedirs(METRICS_MULTIPROC_DIR, exist_ok=True)
+    for path in glob.glob(os.path.join(METRICS_MULTIPROC_DIR, '*.json')):
+        os.remove(path)
+
+
+def reset_metrics():
+    """Forget values (and locks) inherited across fork. Call first thing in a forked child."""
+    for metric in _registry:
+        metric.reset()
+
+
+def _flusher_loop(interval):
+    while not _flusher_stop.wait(interval):
+        try:
+            flush_metrics()
+        except Exception:
+            logger.exception("Metrics snapshot failed")
+
+
+def start_metrics_flusher(interval=METRICS_FLUSH_SECONDS):
+    """Write snapshots periodically so scrapes see this process's recent values."""
+    if not METRICS_MULTIPROC_DIR:
+        return None
+    _flusher_stop.clear()
+    thread = threading.Thread(target=_flusher_loop, args=(interval,),
+                              name='metrics-flusher', daemon=True)
+    thread.start()
+    return thread
+
+
+# --- Application metrics ---
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'nutricheck_http_request_duration_seconds', 'HTTP request latency.',
+    ('method', 'endpoint', 'status'))
+PIPELINE_STAGE_SECONDS = Histogram(
+    'nutricheck_pipeline_stage_duration_seconds', 'Time spent in each analysis pipeline stage.',
+    ('stage',))
+DB_CALL_SECONDS = Histogram(
+    'nutricheck_db_call_duration_seconds', 'Database call latency.', ('operation',))
+ANALYSES_TOTAL = Counter(
+    'nutricheck_analyses_total', 'Completed analysis pipeline runs.', ('outcome',))
+CACHE_REQUESTS_TOTAL = Counter(
+    'nutricheck_cache_requests_total', 'Cache lookups by cache and result (hit/miss).',
+    ('cache', 'result'))
+OCR_READER_INIT_SECONDS = Gauge(
+    'nutricheck_ocr_reader_init_seconds', 'Time taken to load the EasyOCR reader.')
+
+
+def register_queue_gauge(name, documentation, callback):
+    """Expose a queue depth computed at scrape time."""
+    return Gauge(name, documentation, callback=callback)
+
+
+# --- Timing helpers ---
+
+def _record_span(name, seconds):
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((name, seconds))
+
+
+@contextmanager
+def stage_timer(stage):
+    """Time an analysis pipeline stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        PIPELINE_STAGE_SECONDS.observe(elapsed, stage=stage)
+        _record_span(stage, elapsed)
+
+
+def timed_db(operation):
+    """Decorator timing a database function."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                DB_CALL_SECONDS.observe(elapsed, operation=operation)
+                _record_span('db.' + operation, elapsed)
+        return wrapper
+    return decorator
+
+
+def begin_request_spans():
+    """Start collecting spans for the current request. Returns a reset token."""
+    return _request_spans.set([])
+
+
+def end_request_spans(token):
+    """Stop collecting spans and return them as [(name, seconds), ...]."""
+    spans = _request_spans.get() or []
+    _request_spans.reset(token)
+    return spans
+
+
+def iter_with_spans(iterable, spans):
+    """
+    Iterate a response body, recording spans into `spans` while each item is
+    produced. Streamed bodies run after the request's span context has ended.
+    """
+    iterator = iter(iterable)
+    try:
+        while True:
+            token = _request_spans.set(spans)
+            try:
+                item = next(iterator, _END)
+            finally:
+                _request_spans.reset(token)
+            if item is _END:
+                return
+            yield item
+    finally:
+        if hasattr(iterator, 'close'):
+            iterator.close()
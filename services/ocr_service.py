@@ -1,31 +1,253 @@
-import easyocr
-from config import OCR_LANGUAGES, OCR_GPU
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+from config import (
+    OCR_LANGUAGES, OCR_GPU, OCR_MAX_CONCURRENT, OCR_TORCH_THREADS, OCR_MODE,
+    OCR_PROFILES, OCR_DEFAULT_PROFILE, OCR_SUPPORTED_LANGUAGES,
+    OCR_READER_POOL_SIZE, OCR_READER_POOL_BUDGET_BYTES, OCR_READER_SIZE_ESTIMATE_BYTES
+)
+from services.metrics import (
+    OCR_READER_INIT_SECONDS, CACHE_REQUESTS_TOTAL, Gauge, register_queue_gauge
+)
+from services import ocr_stub
 
-# Lazy-loaded global reader
-_reader = None
+logger = logging.getLogger(__name__)
 
+# Loaded readers, least recently used first: {language tuple: (reader, weight bytes)}
+_readers = OrderedDict()
+_readers_lock = threading.Lock()
+# One lock per language set being loaded, so a load never blocks hits on other readers
+_loading = {}
+# Readers loaded before fork (shared copy-on-write): never evicted, not counted in the pool
+_pinned = set()
+# Weight bytes expected for a reader not loaded yet; updated from real loads
+_size_estimate = OCR_READER_SIZE_ESTIMATE_BYTES
 
-def get_reader():
-    """Get or initialize the EasyOCR reader (lazy singleton)."""
-    global _reader
-    if _reader is None:
-        _reader = easyocr.Reader(OCR_LANGUAGES, gpu=OCR_GPU)
-    return _reader
+Gauge('nutricheck_ocr_reader_pool_bytes', 'Model weight bytes held by loaded OCR readers.',
+      callback=lambda: sum(size for _, size in list(_readers.values())))
+Gauge('nutricheck_ocr_readers_loaded', 'OCR readers currently loaded.',
+      callback=lambda: len(_readers))
 
+# Bounds concurrent inferences so request threads that don't need OCR stay responsive
+_ocr_slots = threading.BoundedSemaphore(OCR_MAX_CONCURRENT)
+_ocr_waiting = 0
+_ocr_waiting_lock = threading.Lock()
 
-def extract_text(image_input):
+register_queue_gauge(
+    'nutricheck_ocr_queue_depth', 'OCR calls waiting for a free inference slot.',
+    lambda: _ocr_waiting)
+
+
+def normalize_languages(languages=None):
+    """
+    Validate a language hint (list or comma-separated string) and return the
+    reader pool key: a sorted tuple of EasyOCR codes. Raises ValueError.
+    """
+    if not languages:
+        return tuple(sorted(OCR_LANGUAGES))
+    if isinstance(languages, str):
+        languages = languages.split(',')
+    codes = {code.strip().lower() for code in languages if code.strip()}
+    unknown = sorted(codes - set(OCR_SUPPORTED_LANGUAGES))
+    if unknown:
+        raise ValueError(f"Unsupported OCR language '{unknown[0]}'. "
+                         f"Use: {', '.join(OCR_SUPPORTED_LANGUAGES)}")
+    return tuple(sorted(codes)) or tuple(sorted(OCR_LANGUAGES))
+
+
+def _reader_bytes(reader):
+    """Weight bytes of a reader's detector and recognizer networks."""
+    return sum(p.numel() * p.element_size()
+               for model in (reader.detector, reader.recognizer)
+               for p in model.parameters())
+
+
+def _evict_readers(keep=None, incoming=0):
+    """
+    Drop least recently used readers until the pool, plus a reader of
+    `incoming` bytes about to be loaded, fits its limits. Pinned readers and
+    `keep` are never evicted; pinned ones are not counted either.
+    """
+    while True:
+        pooled = [k for k in _readers if k not in _pinned]
+        count = len(pooled) + (1 if incoming else 0)
+        size = sum(_readers[k][1] for k in pooled) + incoming
+        if count <= OCR_READER_POOL_SIZE and size <= OCR_READER_POOL_BUDGET_BYTES:
+            return
+        evictable = [k for k in pooled if k != keep]
+        if not evictable:
+            return
+        _, evicted = _readers.pop(evictable[0])
+        logger.info("Evicted OCR reader %s (%.0f MB)", ','.join(evictable[0]), evicted / 1e6)
+
+
+def get_reader(languages=None):
+    """
+    Get or load the EasyOCR reader for a language set.
+
+    Readers are kept in a per-process LRU pool bounded by OCR_READER_POOL_SIZE
+    and OCR_READER_POOL_BUDGET_BYTES; room is made before a load, and the
+    reader just requested is never evicted. Readers pinned by preload_reader()
+    sit outside the pool. An evicted reader stays usable by calls holding it.
     """
-    Run EasyOCR on the given image.
+    global _size_estimate
+    key = normalize_languages(languages)
+    with _readers_lock:
+        reader = _cached_reader(key)
+        if reader is not None:
+            return reader
+        load_lock = _loading.setdefault(key, threading.Lock())
+
+    # Loading takes seconds: hold only this language set's lock, so two
+    # threads never build the same reader and other readers stay available
+    with load_lock:
+        with _readers_lock:
+            reader = _cached_reader(key)
+            if reader is not None:
+                return reader
+
+            # Make room first, so the pool never overshoots by the reader being loaded
+            _evict_readers(incoming=_size_estimate)
+
+        CACHE_REQUESTS_TOTAL.inc(cache='ocr_reader', result='miss')
+        # Imported here so replay mode never loads torch
+        import easyocr
+        start = time.perf_counter()
+        reader = easyocr.Reader(list(key), gpu=OCR_GPU)
+        OCR_READER_INIT_SECONDS.set(time.perf_counter() - start)
+        size = _reader_bytes(reader)
+        with _readers_lock:
+            _size_estimate = max(_size_estimate, size)
+            _readers[key] = (reader, size)
+            _evict_readers(key)
+            _loading.pop(key, None)
+        return reader
+
+
+def preload_reader(languages=None):
+    """
+    Load a reader before workers fork and pin it: workers share its pages
+    copy-on-write, so evicting it in a worker would free nothing and the
+    next request would load a private copy.
+    """
+    reader = get_reader(languages)
+    with _readers_lock:
+        _pinned.add(normalize_languages(languages))
+    return reader
+
+
+def _cached_reader(key):
+    """Loaded reader for key (marked most recently used), or None. Hold _readers_lock."""
+    if key not in _readers:
+        return None
+    _readers.move_to_end(key)
+    CACHE_REQUESTS_TOTAL.inc(cache='ocr_reader', result='hit')
+    return _readers[key][0]
+
+
+def configure_worker_threads():
+    """
+    Apply per-process torch thread limits. Call in each forked worker:
+    N workers x default torch threads would oversubscribe the cores.
+    """
+    if OCR_MODE == 'replay':
+        return
+    import torch
+    torch.set_num_threads(OCR_TORCH_THREADS)
+
+
+# OCR boxes that hold a nutrient amount rather than a label, e.g. "12g", "250 kcal", "8%"
+VALUE_TEXT_RE = re.compile(r'^\s*[\dOoIl.,]*\d[\dOoIl.,]*\s*(?:m?g|kcal|kj|%)?\s*$', re.IGNORECASE)
+
+
+def get_profile(name=None):
+    """Return the settings of an OCR profile (default profile if name is None)."""
+    name = name or OCR_DEFAULT_PROFILE
+    if name not in OCR_PROFILES:
+        raise ValueError(f"Unknown OCR profile '{name}'. Use: {', '.join(OCR_PROFILES)}")
+    return OCR_PROFILES[name]
+
+
+def _refine_values(reader, image_input, results, profile):
+    """
+    Re-read boxes that look like nutrient amounts with the recognizer
+    restricted to digits and unit letters, keeping the more confident read.
+    """
+    refined = []
+    for bbox, text, conf in results:
+        if VALUE_TEXT_RE.match(text):
+            xs = [int(p[0]) for p in bbox]
+            ys = [int(p[1]) for p in bbox]
+            reread = reader.recognize(
+                image_input,
+                horizontal_list=[[min(xs), max(xs), min(ys), max(ys)]],
+                free_list=[],
+                decoder=profile['decoder'],
+                beamWidth=profile['beam_width'],
+                allowlist=profile['value_allowlist'],
+                detail=1,
+            )
+            if reread and reread[0][2] > conf:
+                text, conf = reread[0][1], reread[0][2]
+        refined.append((bbox, text, conf))
+    return refined
+
+
+def _run_readtext(reader, image_input, profile):
+    results = reader.readtext(
+        image_input,
+        detail=1,
+        paragraph=False,
+        canvas_size=profile['canvas_size'],
+        mag_ratio=profile['mag_ratio'],
+        batch_size=profile['batch_size'],
+        decoder=profile['decoder'],
+        beamWidth=profile['beam_width'],
+    )
+    if profile['value_allowlist']:
+        results = _refine_values(reader, image_input, results, profile)
+    return results
+
+
+def extract_text(image_input, profile=None, languages=None):
+    """
+    Run EasyOCR on the given image (or replay recorded results, see OCR_MODE).
     
     Args:
         image_input: file path (str) or numpy array (preprocessed image)
+        profile: name of an OCR_PROFILES entry (defaults to OCR_DEFAULT_PROFILE)
+        languages: language hint, e.g. ['de'] (defaults to OCR_LANGUAGES)
     
     Returns:
         List of detected text strings and the raw result list.
     """
-    reader = get_reader()
-    results = reader.readtext(image_input, detail=1, paragraph=False)
+    settings = get_profile(profile)
+    profile = profile or OCR_DEFAULT_PROFILE
+    key = normalize_languages(languages)
+    if OCR_MODE == 'replay':
+        return _build_result(ocr_stub.replay(image_input, key, profile))
+
+    global _ocr_waiting
+    reader = get_reader(key)
+    with _ocr_waiting_lock:
+        _ocr_waiting += 1
+    _ocr_slots.acquire()
+    with _ocr_waiting_lock:
+        _ocr_waiting -= 1
+    try:
+        results = _run_readtext(reader, image_input, settings)
+    finally:
+        _ocr_slots.release()
+
+    if OCR_MODE == 'record':
+        ocr_stub.record(image_input, results, key, profile)
+    return _build_result(results)
+
 
+def _build_result(results):
+    """Shape readtext output into texts, full text and raw results."""
     # Extract text strings
     texts = [entry[1] for entry in results]
 
@@ -0,0 +1,77 @@
+import os
+import json
+import fcntl
+import hashlib
+import threading
+import numpy as np
+from config import OCR_RECORDINGS_PATH, OCR_LANGUAGES, OCR_DEFAULT_PROFILE
+from services.file_utils import write_atomic
+
+# Recorded OCR results keyed by a hash of the OCR input (plus the language set
+# and OCR profile when not the defaults, so recordings made before either
+# existed still match): {key: [[bbox, text, confidence], ...]}
+_recordings = None
+_lock = threading.Lock()
+
+
+def input_key(image_input, languages=None, profile=None):
+    """Stable hash of an OCR input (image file contents or a numpy array)."""
+    h = hashlib.sha1()
+    if languages and sorted(languages) != sorted(OCR_LANGUAGES):
+        h.update(','.join(sorted(languages)).encode('ascii'))
+    if profile and profile != OCR_DEFAULT_PROFILE:
+        h.update(b'profile:' + profile.encode('ascii'))
+    if isinstance(image_input, np.ndarray):
+        h.update(str((image_input.shape, image_input.dtype.str)).encode('ascii'))
+        h.update(np.ascontiguousarray(image_input).tobytes())
+    else:
+        with open(image_input, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def _load():
+    global _recordings
+    if _recordings is None:
+        if os.path.exists(OCR_RECORDINGS_PATH):
+            with open(OCR_RECORDINGS_PATH, encoding='utf-8') as f:
+                _recordings = json.load(f)
+        else:
+            _recordings = {}
+    return _recordings
+
+
+def _to_jsonable(results):
+    return [[[[float(x), float(y)] for x, y in bbox], text, float(conf)]
+            for bbox, text, conf in results]
+
+
+def record(image_input, results, languages=None, profile=None):
+    """
+    Store live OCR results for later replay. Each gunicorn worker records
+    into the same file, so the write merges with what is on disk under a
+    file lock rather than overwriting it with this process's entries.
+    """
+    key = input_key(image_input, languages, profile)
+    entry = _to_jsonable(results)
+    os.makedirs(os.path.dirname(OCR_RECORDINGS_PATH) or '.', exist_ok=True)
+    with _lock, open(OCR_RECORDINGS_PATH + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        recordings = _load()
+        if os.path.exists(OCR_RECORDINGS_PATH):
+            with open(OCR_RECORDINGS_PATH, encoding='utf-8') as f:
+                recordings.update(json.load(f))
+        recordings[key] = entry
+        write_atomic(OCR_RECORDINGS_PATH, json.dumps(recordings))
+
+
+def replay(image_input, languages=None, profile=None):
+    """
+    Return recorded results for this input in EasyOCR's readtext shape.
+    Unrecorded inputs return no detections, like a blank label would.
+    """
+    key = input_key(image_input, languages, profile)
+    with _lock:
+        entries = _load().get(key, [])
+    return [(bbox, text, conf) for bbox, text, conf in entries]
@@ -1,15 +1,22 @@
 import os
 import io
+import re
+import glob
+import json
+import hashlib
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm, inch
 from reportlab.lib.colors import HexColor
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.platypus import (
     SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle,
-    Image as RLImage, HRFlowable
+    Image as RLImage, HRFlowable, PageBreak
 )
 from reportlab.lib.enums import TA_CENTER, TA_LEFT
 from config import REPORT_FOLDER
+from services.thumbnail_service import pdf_image_path
+from services.metrics import CACHE_REQUESTS_TOTAL, stage_timer
+from services.file_utils import atomic_path
 
 
 # Color palette
@@ -21,6 +28,79 @@ COLOR_DARK = HexColor('#2D3436')
 COLOR_LIGHT = HexColor('#DFE6E9')
 COLOR_WHITE = HexColor('#FFFFFF')
 
+# nutricheck_report_<id>.pdf (legacy) or nutricheck_report_<id>_<fingerprint>.pdf
+REPORT_NAME_RE = re.compile(r'^nutricheck_report_(\d+)(?:_([0-9a-f]{16}))?\.pdf$')
+
+
+# Shared paragraph styles, built once at import
+_styles = getSampleStyleSheet()
+
+TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=_styles['Title'],
+    fontSize=24,
+    textColor=COLOR_PRIMARY,
+    spaceAfter=6,
+    alignment=TA_CENTER,
+)
+SUBTITLE_STYLE = ParagraphStyle(
+    'Subtitle',
+    parent=_styles['Normal'],
+    fontSize=10,
+    textColor=COLOR_DARK,
+    alignment=TA_CENTER,
+    spaceAfter=12,
+)
+HEADING_STYLE = ParagraphStyle(
+    'CustomHeading',
+    parent=_styles['Heading2'],
+    fontSize=14,
+    textColor=COLOR_PRIMARY,
+    spaceBefore=12,
+    spaceAfter=6,
+)
+BODY_STYLE = ParagraphStyle(
+    'CustomBody',
+    parent=_styles['Normal'],
+    fontSize=10,
+    textColor=COLOR_DARK,
+    spaceAfter=6,
+    leading=14,
+)
+VERDICT_STYLE = ParagraphStyle(
+    'Verdict',
+    parent=_styles['Normal'],
+    fontSize=18,
+    alignment=TA_CENTER,
+    spaceAfter=6,
+    spaceBefore=6,
+)
+SCORE_STYLE = ParagraphStyle(
+    'Score',
+    parent=_styles['Title'],
+    fontSize=36,
+    alignment=TA_CENTER,
+    textColor=COLOR_PRIMARY,
+    spaceAfter=2,
+)
+FOOTER_STYLE = ParagraphStyle(
+    'Footer',
+    parent=_styles['Normal'],
+    fontSize=8,
+    textColor=COLOR_LIGHT,
+    alignment=TA_CENTER,
+)
+
+# Bump when the report layout changes so cached PDFs are rebuilt
+REPORT_LAYOUT_VERSION = 2
+
+# Analysis fields that affect the rendered report
+REPORT_FIELDS = (
+    'id', 'product_name', 'created_at', 'image_path', 'health_score', 'verdict',
+    'calories', 'sugar', 'fat', 'sodium', 'protein', 'fiber',
+    'explanation', 'recommendation',
+)
+
 
 def get_verdict_color(verdict):
     if verdict == 'Healthy Choice':
@@ -31,22 +111,60 @@ def get_verdict_color(verdict):
         return COLOR_RED
 
 
-def generate_pdf(analysis):
+def report_fingerprint(analysis):
+    """Content hash of the fields rendered into a report."""
+    payload = [REPORT_LAYOUT_VERSION] + [analysis.get(f) for f in REPORT_FIELDS]
+    raw = json.dumps(payload, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+def report_path(analysis_id, fingerprint):
+    """Cache location of the report for an analysis at a given fingerprint."""
+    return os.path.join(REPORT_FOLDER, f"nutricheck_report_{analysis_id}_{fingerprint}.pdf")
+
+
+def invalidate_reports(analysis_id, keep=None):
+    """Delete cached reports for an analysis, optionally keeping one path."""
+    pattern = os.path.join(REPORT_FOLDER, f"nutricheck_report_{analysis_id}*.pdf")
+    for path in glob.glob(pattern):
+        # The glob is a prefix match: report 1 must not take reports 12, 105, ... with it
+        match = REPORT_NAME_RE.match(os.path.basename(path))
+        if path == keep or not match or int(match.group(1)) != int(analysis_id):
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def get_report(analysis):
     """
-    Generate a PDF report for the given analysis data.
-    
-    Args:
-        analysis: dict with all analysis fields
-    
+    Return a cached PDF for the analysis, rendering it if the analysis
+    changed since the cached copy was built.
+
     Returns:
-        Path to the generated PDF file
+        (path, fingerprint, cache_hit)
     """
+    fingerprint = report_fingerprint(analysis)
+    filepath = report_path(analysis['id'], fingerprint)
+    if os.path.exists(filepath):
+        CACHE_REQUESTS_TOTAL.inc(cache='report', result='hit')
+        return filepath, fingerprint, True
+    CACHE_REQUESTS_TOTAL.inc(cache='report', result='miss')
+
     os.makedirs(REPORT_FOLDER, exist_ok=True)
-    filename = f"nutricheck_report_{analysis['id']}.pdf"
-    filepath = os.path.join(REPORT_FOLDER, filename)
+    # Render to a private temp file so concurrent downloads never see a partial PDF
+    with atomic_path(filepath) as tmp_path, stage_timer('report_render'):
+        generate_pdf(analysis, tmp_path)
+
+    invalidate_reports(analysis['id'], keep=filepath)
+    return filepath, fingerprint, False
+
 
-    doc = SimpleDocTemplate(
-        filepath,
+def _new_document(output):
+    """Create the A4 document template writing to a path or file-like object."""
+    return SimpleDocTemplate(
+        output,
         pagesize=A4,
         rightMargin=20 * mm,
         leftMargin=20 * mm,
@@ -54,98 +172,47 @@ def generate_pdf(analysis):
         bottomMargin=15 * mm,
     )
 
-    styles = getSampleStyleSheet()
 
-    # Custom styles
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Title'],
-        fontSize=24,
-        textColor=COLOR_PRIMARY,
-        spaceAfter=6,
-        alignment=TA_CENTER,
-    )
-    subtitle_style = ParagraphStyle(
-        'Subtitle',
-        parent=styles['Normal'],
-        fontSize=10,
-        textColor=COLOR_DARK,
-        alignment=TA_CENTER,
-        spaceAfter=12,
-    )
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading2'],
-        fontSize=14,
-        textColor=COLOR_PRIMARY,
-        spaceBefore=12,
-        spaceAfter=6,
-    )
-    body_style = ParagraphStyle(
-        'CustomBody',
-        parent=styles['Normal'],
-        fontSize=10,
-        textColor=COLOR_DARK,
-        spaceAfter=6,
-        leading=14,
-    )
-    verdict_style = ParagraphStyle(
-        'Verdict',
-        parent=styles['Normal'],
-        fontSize=18,
-        alignment=TA_CENTER,
-        spaceAfter=6,
-        spaceBefore=6,
-    )
-    score_style = ParagraphStyle(
-        'Score',
-        parent=styles['Title'],
-        fontSize=36,
-        alignment=TA_CENTER,
-        textColor=COLOR_PRIMARY,
-        spaceAfter=2,
-    )
+def _analysis_section(analysis, image=None):
+    """
+    Flowables for one analysed product: image, score, verdict, nutrient
+    table, explanation and recommendation.
 
+    Args:
+        analysis: dict with all analysis fields
+        image: path or file-like image to embed (defaults to the upload's
+               report-sized derivative; False omits the image)
+    """
     elements = []
 
-    # --- Header ---
-    elements.append(Paragraph("🍎 NutriCheck Report", title_style))
-    elements.append(Paragraph(
-        f"Product: {analysis.get('product_name', 'Unknown')} | "
-        f"Date: {analysis.get('created_at', 'N/A')}",
-        subtitle_style
-    ))
-    elements.append(HRFlowable(
-        width="100%", thickness=1, color=COLOR_PRIMARY, spaceAfter=10
-    ))
-
     # --- Product Image ---
-    image_path = analysis.get('image_path', '')
-    if image_path and os.path.exists(image_path):
+    if image is None:
+        image = pdf_image_path(analysis.get('image_path', ''))
+    if image:
         try:
-            img = RLImage(image_path, width=3 * inch, height=3 * inch, kind='proportional')
+            img = RLImage(image, width=3 * inch, height=3 * inch, kind='proportional')
             elements.append(img)
             elements.append(Spacer(1, 8))
         except Exception:
             pass
 
     # --- Health Score ---
-    elements.append(Paragraph("Health Score", heading_style))
+    elements.append(Paragraph("Health Score", HEADING_STYLE))
     elements.append(Paragraph(
         f"{analysis.get('health_score', 'N/A')} / 100",
-        score_style
+        SCORE_STYLE
     ))
 
     verdict = analysis.get('verdict', '')
     vc = get_verdict_color(verdict)
     elements.append(Paragraph(
         f'<font color="{vc.hexval()}">{verdict}</font>',
-        verdict_style
+        VERDICT_STYLE
     ))
     elements.append(Spacer(1, 6))
 
     # --- Nutrient Table ---
-    elements.append(Paragraph("Nutritional Information", heading_style))
+    elements.append(Paragraph("Nutritional Information", HEADING_STYLE))
 
     nutrients_data = [
         ['Nutrient', 'Value', 'Unit'],
@@ -177,26 +244,157 @@ def generate_pdf(analysis):
     # --- Explanation ---
     explanation = analysis.get('explanation', '')
     if explanation:
-        elements.append(Paragraph("Analysis Explanation", heading_style))
-        elements.append(Paragraph(explanation, body_style))
+        elements.append(Paragraph("Analysis Explanation", HEADING_STYLE))
+        elements.append(Paragraph(explanation, BODY_STYLE))
 
     # --- Recommendation ---
     recommendation = analysis.get('recommendation', '')
     if recommendation:
-        elements.append(Paragraph("Dietary Recommendation", heading_style))
-        elements.append(Paragraph(recommendation, body_style))
+        elements.append(Paragraph("Dietary Recommendation", HEADING_STYLE))
+        elements.append(Paragraph(recommendation, BODY_STYLE))
+
+    return elements
 
-    # --- Footer ---
+
+def _footer():
+    """Closing rule and attribution line."""
+    elements = []
     elements.append(Spacer(1, 20))
     elements.append(HRFlowable(
         width="100%", thickness=0.5, color=COLOR_LIGHT, spaceAfter=6
     ))
     elements.append(Paragraph(
         "Generated by NutriCheck — Food Label Reader & Health Analyzer",
-        ParagraphStyle('Footer', parent=styles['Normal'],
-                       fontSize=8, textColor=COLOR_LIGHT, alignment=TA_CENTER)
+        FOOTER_STYLE
     ))
+    return elements
+
+
+def generate_pdf(analysis, output=None):
+    """
+    Generate a PDF report for the given analysis data.
+    
+    Args:
+        analysis: dict with all analysis fields
+        output: file path or writable file-like object (e.g. BytesIO);
+                defaults to the report cache location
+    
+    Returns:
+        The output the PDF was written to
+    """
+    if output is None:
+        os.makedirs(REPORT_FOLDER, exist_ok=True)
+        output = report_path(analysis['id'], report_fingerprint(analysis))
+
+    doc = _new_document(output)
+
+    elements = []
+
+    # --- Header ---
+    elements.append(Paragraph("🍎 NutriCheck Report", TITLE_STYLE))
+    elements.append(Paragraph(
+        f"Product: {analysis.get('product_name', 'Unknown')} | "
+        f"Date: {analysis.get('created_at', 'N/A')}",
+        SUBTITLE_STYLE
+    ))
+    elements.append(HRFlowable(
+        width="100%", thickness=1, color=COLOR_PRIMARY, spaceAfter=10
+    ))
+
+    elements.extend(_analysis_section(analysis))
+    elements.extend(_footer())
 
     # Build PDF
     doc.build(elements)
-    return filepath
+    return output
+
+
+def render_pdf_buffer(analysis):
+    """Render the report for an analysis into memory. Returns a rewound BytesIO."""
+    buffer = io.BytesIO()
+    generate_pdf(analysis, buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def _comparison_summary(analyses):
+    """Side-by-side score and nutrient table for all compared products."""
+    nutrients = [('Calories', 'calories', 'kcal'), ('Sugar', 'sugar', 'g'), ('Fat', 'fat', 'g'),
+                 ('Sodium', 'sodium', 'mg'), ('Protein', 'protein', 'g'), ('Fiber', 'fiber', 'g')]
+
+    rows = [['Product', 'Score'] + [f'{label} ({unit})' for label, _, unit in nutrients]]
+    for a in analyses:
+        rows.append(
+            [Paragraph(str(a.get('product_name') or 'Unknown'), BODY_STYLE),
+             str(a.get('health_score', 'N/A'))]
+            + [str(a.get(key) if a.get(key) is not None else 'N/A') for _, key, _ in nutrients]
+        )
+
+    table = Table(rows, colWidths=[40 * mm, 15 * mm] + [19 * mm] * len(nutrients), repeatRows=1)
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), COLOR_PRIMARY),
+        ('TEXTCOLOR', (0, 0), (-1, 0), COLOR_WHITE),
+        ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 8),
+        ('FONTSIZE', (0, 1), (-1, -1), 9),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [COLOR_WHITE, COLOR_LIGHT]),
+        ('GRID', (0, 0), (-1, -1), 0.5, COLOR_LIGHT),
+    ]))
+
+    best = max(analyses, key=lambda a: a.get('health_score') or 0)
+    return [
+        table,
+        Spacer(1, 10),
+        Paragraph(
+            f"Best pick: <b>{best.get('product_name') or 'Unknown'}</b> "
+            f"({best.get('health_score', 'N/A')} / 100)",
+            BODY_STYLE
+        ),
+    ]
+
+
+def generate_comparison_pdf(analyses, output=None):
+    """
+    Generate one PDF comparing several analyses: a summary table followed
+    by a full section per product.
+
+    Runs serially: report images normally exist from upload time, and most
+    of the time goes to doc.build(), which lays out pages in order.
+
+    Args:
+        analyses: list of analysis dicts, in display order
+        output: file path or writable file-like object; defaults to a new BytesIO
+
+    Returns:
+        The output the PDF was written to (BytesIO rewound to the start)
+    """
+    with stage_timer('comparison_images'):
+        # Derivatives usually exist already (made at upload); only missing ones cost a decode
+        images = [pdf_image_path(a.get('image_path')) for a in analyses]
+
+    buffer = output if output is not None else io.BytesIO()
+    doc = _new_document(buffer)
+
+    elements = [
+        Paragraph("🍎 NutriCheck Comparison Report", TITLE_STYLE),
+        Paragraph(f"{len(analyses)} products compared", SUBTITLE_STYLE),
+        HRFlowable(width="100%", thickness=1, color=COLOR_PRIMARY, spaceAfter=10),
+    ]
+    elements.extend(_comparison_summary(analyses))
+
+    for analysis, image in zip(analyses, images):
+        elements.append(PageBreak())
+        elements.append(Paragraph(str(analysis.get('product_name') or 'Unknown'), HEADING_STYLE))
+        elements.append(HRFlowable(width="100%", thickness=0.5, color=COLOR_PRIMARY, spaceAfter=8))
+        # Sections without a readable image simply omit it
+        elements.extend(_analysis_section(analysis, image=image or False))
+
+    elements.extend(_footer())
+    with stage_timer('comparison_render'):
+        doc.build(elements)
+
+    if output is None:
+        buffer.seek(0)
+    return buffer
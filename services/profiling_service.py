@@ -0,0 +1,286 @@
+import os
+import re
+import hmac
+import json
+import time
+import random
+import pstats
+import cProfile
+import logging
+import itertools
+import threading
+import tracemalloc
+from datetime import datetime, timezone
+from config import (
+    PROFILE_TOKEN, PROFILE_SAMPLE_RATE, PROFILE_FOLDER, PROFILE_RING_SIZE,
+    PROFILE_TOP_FUNCTIONS, PROFILE_TOP_ALLOCATIONS, PROFILE_TRACEMALLOC_FRAMES,
+    PROFILE_MAX_CAPTURE_SECONDS
+)
+from services.file_utils import write_atomic
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-NutriCheck-Profile'
+CAPTURE_ID_RE = re.compile(r'^\d+-\d+-\d+$')
+
+# Never profile the endpoints that serve captures or metrics
+_SKIP_PREFIXES = ('/api/profiles', '/metrics', '/static/')
+
+# cProfile and tracemalloc are process-wide: one capture at a time
+_capture_lock = threading.Lock()
+_sequence = itertools.count()
+
+
+def profiling_enabled():
+    # Captures can only be read back with the token, so sampling alone is refused
+    return bool(PROFILE_TOKEN)
+
+
+def token_valid(value):
+    """Constant-time check of a request's profile token."""
+    return bool(PROFILE_TOKEN) and bool(value) and hmac.compare_digest(value, PROFILE_TOKEN)
+
+
+def _trigger(environ):
+    """Return why this request should be profiled, or None."""
+    if environ.get('PATH_INFO', '').startswith(_SKIP_PREFIXES):
+        return None
+    if token_valid(environ.get('HTTP_X_NUTRICHECK_PROFILE')):
+        return 'header'
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return 'sample'
+    return None
+
+
+class ProfilingMiddleware:
+    """
+    WSGI middleware capturing cProfile + tracemalloc data for selected requests.
+
+    Only installed when profiling is enabled (see install_profiler), so
+    requests pay nothing when it is off. Streamed responses are profiled
+    while each chunk is produced.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        trigger = _trigger(environ)
+        if trigger is None or not _capture_lock.acquire(blocking=False):
+            return self.wsgi_app(environ, start_response)
+        status = {}
+
+        def recording_start_response(status_line, headers, exc_info=None):
+            status['code'] = int(status_line.split(' ', 1)[0])
+            return start_response(status_line, headers, exc_info)
+
+        capture = None
+        try:
+            capture = _Capture(environ, trigger)
+            with capture.active():
+                body = self.wsgi_app(environ, recording_start_response)
+        except BaseException:
+            if capture is not None:
+                capture.finish(500)
+            _capture_lock.release()
+            raise
+        return _ProfiledBody(body, capture, status)
+
+
+class _ProfiledBody:
+    """Response iterable that profiles each chunk and stores the capture on close()."""
+
+    def __init__(self, body, capture, status):
+        self.body = body
+        self.capture = capture
+        self.status = status
+        self.closed = False
+
+    def __iter__(self):
+        iterator = iter(self.body)
+        while True:
+            with self.capture.active():
+                chunk = next(iterator, None)
+            if chunk is None:
+                return
+            yield chunk
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.capture.finish(self.status.get('code', 500))
+            _capture_lock.release()
+
+
+class _Capture:
+    def __init__(self, environ, trigger):
+        self.method = environ.get('REQUEST_METHOD', '')
+        self.path = environ.get('PATH_INFO', '')
+        self.trigger = trigger
+        self.started_at = datetime.now(timezone.utc)
+        self.elapsed = 0.0
+        self.truncated = False
+        self.snapshot = None
+        self.peak = 0
+        self._tracing_lock = threading.Lock()
+        self.profiler = cProfile.Profile()
+        # Leave tracemalloc alone if something else already started it
+        self.owns_tracemalloc = not tracemalloc.is_tracing()
+        if self.owns_tracemalloc:
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+        tracemalloc.reset_peak()
+        # tracemalloc hooks every allocation of every thread in the worker, so
+        # concurrent requests slow down too while it runs: bound how long it does
+        self._deadline = threading.Timer(PROFILE_MAX_CAPTURE_SECONDS, self._stop_tracing, (True,))
+        self._deadline.daemon = True
+        self._deadline.start()
+
+    def active(self):
+        return _Active(self)
+
+    def _stop_tracing(self, truncated=False):
+        with self._tracing_lock:
+            if self.snapshot is not None:
+                return
+            self.snapshot = tracemalloc.take_snapshot()
+            _, self.peak = tracemalloc.get_traced_memory()
+            if self.owns_tracemalloc:
+                tracemalloc.stop()
+            self.truncated = truncated
+
+    def finish(self, status_code):
+        try:
+            self._deadline.cancel()
+            self._stop_tracing()
+            _write_capture(self, status_code, self.snapshot, self.peak)
+        except Exception:
+            logger.exception("Could not store profile capture for %s %s", self.method, self.path)
+
+
+class _Active:
+    """Profile (and time) the enclosed block."""
+
+    def __init__(self, capture):
+        self.capture = capture
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.capture.profiler.enable()
+
+    def __exit__(self, *exc):
+        self.capture.profiler.disable()
+        self.capture.elapsed += time.perf_counter() - self.start
+        return False
+
+
+def _top_functions(profiler):
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)
+    return [{
+        'function': pstats.func_std_string(func),
+        'calls': nc,
+        'total_s': round(tt, 6),
+        'cumulative_s': round(ct, 6),
+    } for func, (cc, nc, tt, ct, callers) in rows[:PROFILE_TOP_FUNCTIONS]]
+
+
+def _top_allocations(snapshot):
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+    ))
+    return [{
+        'location': f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+        'size_bytes': stat.size,
+        'count': stat.count,
+    } for stat in snapshot.statistics('lineno')[:PROFILE_TOP_ALLOCATIONS]]
+
+
+def _write_capture(capture, status_code, snapshot, peak):
+    os.makedirs(PROFILE_FOLDER, exist_ok=True)
+    capture_id = f"{int(capture.started_at.timestamp() * 1000)}-{os.getpid()}-{next(_sequence)}"
+    capture.profiler.dump_stats(os.path.join(PROFILE_FOLDER, capture_id + '.prof'))
+
+    summary = {
+        'id': capture_id,
+        'method': capture.method,
+        'path': capture.path,
+        'status': status_code,
+        'trigger': capture.trigger,
+        'started_at': capture.started_at.isoformat(),
+        'duration_ms': round(capture.elapsed * 1000, 2),
+        'pid': os.getpid(),
+        'peak_traced_bytes': peak,
+        'truncated': capture.truncated,
+        'top_functions': _top_functions(capture.profiler),
+        'top_allocations': _top_allocations(snapshot),
+    }
+    # The summary is written last, so listings only see complete captures
+    write_atomic(os.path.join(PROFILE_FOLDER, capture_id + '.json'), json.dumps(summary))
+    _trim_ring()
+
+
+def _capture_ids():
+    """Stored capture IDs, oldest first."""
+    try:
+        names = os.listdir(PROFILE_FOLDER)
+    except FileNotFoundError:
+        return []
+    ids = [n[:-len('.json')] for n in names
+           if n.endswith('.json') and CAPTURE_ID_RE.match(n[:-len('.json')])]
+    return sorted(ids, key=lambda i: tuple(int(p) for p in i.split('-')))
+
+
+def _trim_ring():
+    for capture_id in _capture_ids()[:-PROFILE_RING_SIZE]:
+        for ext in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(PROFILE_FOLDER, capture_id + ext))
+            except FileNotFoundError:
+                pass
+
+
+def list_captures():
+    """Summaries of stored captures (without the per-function detail), newest first."""
+    captures = []
+    for capture_id in reversed(_capture_ids()):
+        summary = get_capture(capture_id)
+        if summary:
+            summary.pop('top_functions', None)
+            summary.pop('top_allocations', None)
+            captures.append(summary)
+    return captures
+
+
+def get_capture(capture_id):
+    """Full summary of one capture, or None."""
+    if not CAPTURE_ID_RE.match(capture_id):
+        return None
+    try:
+        with open(os.path.join(PROFILE_FOLDER, capture_id + '.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def capture_stats_path(capture_id):
+    """Path of a capture's pstats file (load with `python -m pstats`), or None."""
+    if not CAPTURE_ID_RE.match(capture_id):
+        return None
+    path = os.path.join(PROFILE_FOLDER, capture_id + '.prof')
+    return path if os.path.isfile(path) else None
+
+
+def install_profiler(app):
+    """Wrap the app's WSGI callable when profiling is enabled; no-op otherwise."""
+    if PROFILE_SAMPLE_RATE > 0 and not PROFILE_TOKEN:
+        logger.error("NUTRICHECK_PROFILE_SAMPLE_RATE is set without NUTRICHECK_PROFILE_TOKEN; "
+                     "profiling stays off, since captures could not be read")
+    if profiling_enabled():
+        app.wsgi_app = ProfilingMiddleware(app.wsgi_app)
+        logger.warning("Request profiling enabled (sample rate %.3f)", PROFILE_SAMPLE_RATE)
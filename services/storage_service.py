@@ -0,0 +1,235 @@
+import os
+import re
+import time
+import logging
+import threading
+from config import (
+    UPLOAD_FOLDER, REPORT_FOLDER, DERIVED_FOLDER, SWEEP_INTERVAL_SECONDS, SWEEP_BATCH_SIZE,
+    ORPHAN_GRACE_SECONDS, STORAGE_QUOTA_BYTES, SWEEP_LOCK_PATH
+)
+from database import get_image_references, compact_changes
+from services.pdf_service import REPORT_NAME_RE, invalidate_reports
+from services.thumbnail_service import derivative_paths, source_name, DERIVATIVE_SUFFIXES
+
+logger = logging.getLogger(__name__)
+
+# Background sweeper state
+_sweeper_thread = None
+_sweeper_stop = threading.Event()
+_sweep_lock = threading.Lock()
+_sweeper_lock_file = None
+
+
+def _basename(path):
+    """Basename that also handles paths stored by a Windows host."""
+    return re.split(r'[\\/]', path)[-1]
+
+
+def _scan(folder):
+    """Return a list of (path, size, atime, mtime) for regular files in folder."""
+    entries = []
+    if not os.path.isdir(folder):
+        return entries
+    with os.scandir(folder) as it:
+        for entry in it:
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            st = entry.stat(follow_symlinks=False)
+            entries.append((entry.path, st.st_size, st.st_atime, st.st_mtime))
+    return entries
+
+
+def find_orphans(now=None):
+    """
+    Reconcile files on disk with database rows.
+
+    An upload is orphaned when no analysis references it; a report is
+    orphaned when its analysis ID no longer exists; an image derivative is
+    orphaned when its source upload is no longer referenced. Files newer than
+    ORPHAN_GRACE_SECONDS are skipped because the upload is saved before
+    its analysis row is inserted.
+
+    Returns:
+        list of (path, size) tuples
+    """
+    now = now or time.time()
+    references = get_image_references()
+    referenced_images = {_basename(p) for p in references.values() if p}
+
+    orphans = []
+    for path, size, _, mtime in _scan(UPLOAD_FOLDER):
+        if now - mtime < ORPHAN_GRACE_SECONDS:
+            continue
+        if os.path.basename(path) not in referenced_images:
+            orphans.append((path, size))
+
+    for path, size, _, mtime in _scan(REPORT_FOLDER):
+        if now - mtime < ORPHAN_GRACE_SECONDS:
+            continue
+        name = os.path.basename(path)
+        match = REPORT_NAME_RE.match(name)
+        # Leftover temp files from interrupted renders are orphans too
+        if name.endswith('.tmp') or (match and int(match.group(1)) not in references):
+            orphans.append((path, size))
+
+    for path, size, _, mtime in _scan(DERIVED_FOLDER):
+        if now - mtime < ORPHAN_GRACE_SECONDS:
+            continue
+        name = os.path.basename(path)
+        if name.endswith('.tmp') or source_name(name) not in referenced_images:
+            orphans.append((path, size))
+
+    return orphans
+
+
+def _delete_batched(paths_with_sizes, batch_size, dry_run=False):
+    """Delete files in batches, yielding the CPU between batches. Returns (count, bytes)."""
+    count = 0
+    reclaimed = 0
+    for start in range(0, len(paths_with_sizes), batch_size):
+        for path, size in paths_with_sizes[start:start + batch_size]:
+            if not dry_run:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    logger.warning("Could not delete %s: %s", path, e)
+                    continue
+            count += 1
+            reclaimed += size
+        if not dry_run:
+            time.sleep(0)
+    return count, reclaimed
+
+
+def enforce_quota(quota_bytes=STORAGE_QUOTA_BYTES, batch_size=SWEEP_BATCH_SIZE, dry_run=False):
+    """
+    Evict derived artifacts (generated reports and report-sized images),
+    least recently used first, until everything fits within quota_bytes.
+    Uploads are source data and thumbnails are tiny and served on every
+    history view, so neither is evicted here.
+
+    Returns:
+        (files_evicted, bytes_reclaimed)
+    """
+    if quota_bytes is None:
+        return 0, 0
+
+    uploads = _scan(UPLOAD_FOLDER)
+    derived = _scan(REPORT_FOLDER)
+    thumbs = []
+    for entry in _scan(DERIVED_FOLDER):
+        (derived if entry[0].endswith(DERIVATIVE_SUFFIXES['pdf']) else thumbs).append(entry)
+    total = sum(e[1] for e in uploads) + sum(e[1] for e in derived) + sum(e[1] for e in thumbs)
+    if total <= quota_bytes:
+        return 0, 0
+
+    # LRU: last access (falls back to mtime on noatime mounts)
+    derived.sort(key=lambda e: max(e[2], e[3]))
+    victims = []
+    for path, size, _, _ in derived:
+        if total <= quota_bytes:
+            break
+        victims.append((path, size))
+        total -= size
+
+    if total > quota_bytes:
+        logger.warning("Storage still over quota after evicting all derived files (%d bytes)", total)
+    return _delete_batched(victims, batch_size, dry_run)
+
+
+def sweep(batch_size=SWEEP_BATCH_SIZE, quota_bytes=STORAGE_QUOTA_BYTES, dry_run=False):
+    """
+    Run one full reconciliation pass: delete orphans, then enforce the quota.
+
+    Returns:
+        dict with counts and bytes reclaimed
+    """
+    with _sweep_lock:
+        orphans = find_orphans()
+        orphan_count, orphan_bytes = _delete_batched(orphans, batch_size, dry_run)
+        evicted_count, evicted_bytes = enforce_quota(quota_bytes, batch_size, dry_run)
+        changes_compacted = 0 if dry_run else compact_changes()
+
+    stats = {
+        'orphans_deleted': orphan_count,
+        'orphan_bytes': orphan_bytes,
+        'derived_evicted': evicted_count,
+        'evicted_bytes': evicted_bytes,
+        'bytes_reclaimed': orphan_bytes + evicted_bytes,
+        'changes_compacted': changes_compacted,
+        'dry_run': dry_run,
+    }
+    if stats['bytes_reclaimed']:
+        logger.info("Storage sweep reclaimed %d bytes (%d orphans, %d derived files evicted)",
+                    stats['bytes_reclaimed'], orphan_count, evicted_count)
+    return stats
+
+
+def delete_analysis_files(analysis_id, image_path):
+    """Remove the upload, its derivatives and cached reports of a deleted analysis."""
+    invalidate_reports(analysis_id)
+    paths = []
+    if image_path:
+        upload = os.path.join(UPLOAD_FOLDER, _basename(image_path))
+        # Another analysis may share the same upload
+        if _basename(image_path) not in {_basename(p) for p in get_image_references().values() if p}:
+            paths.append(upload)
+            paths.extend(derivative_paths(upload).values())
+
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Could not delete %s: %s", path, e)
+
+
+def _sweeper_loop(interval):
+    while not _sweeper_stop.wait(interval):
+        try:
+            sweep()
+        except Exception:
+            logger.exception("Storage sweep failed")
+
+
+def start_sweeper(interval=SWEEP_INTERVAL_SECONDS):
+    """Start the background sweeper thread (idempotent). interval <= 0 disables it."""
+    global _sweeper_thread
+    if not interval or interval <= 0:
+        return None
+    if _sweeper_thread is not None and _sweeper_thread.is_alive():
+        return _sweeper_thread
+    _sweeper_stop.clear()
+    _sweeper_thread = threading.Thread(
+        target=_sweeper_loop, args=(interval,), name='storage-sweeper', daemon=True
+    )
+    _sweeper_thread.start()
+    return _sweeper_thread
+
+
+def claim_sweeper(lock_path=SWEEP_LOCK_PATH):
+    """
+    Try to become the one process (of several gunicorn workers) that sweeps.
+    The file lock is held until this process exits, so exactly one worker
+    sweeps, and the worker forked to replace it takes over. Unix only.
+    """
+    global _sweeper_lock_file
+    import fcntl
+    if _sweeper_lock_file is not None:
+        return True
+    lock_file = open(lock_path, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _sweeper_lock_file = lock_file
+    return True
+
+
+def stop_sweeper():
+    """Signal the background sweeper thread to exit."""
+    _sweeper_stop.set()
@@ -0,0 +1,202 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from config import (
+    UPLOAD_FOLDER, DERIVED_FOLDER, THUMB_MAX_SIZE, THUMB_WEBP_QUALITY, THUMB_JPEG_QUALITY,
+    PDF_IMAGE_MAX_WIDTH, PDF_IMAGE_MAX_HEIGHT, PDF_IMAGE_JPEG_QUALITY, THUMBNAIL_WORKERS,
+    DERIVATIVE_VERSION
+)
+from services.image_processor import (
+    resize_image, load_image, read_image_size, decode_estimate, image_budget
+)
+from services.metrics import register_queue_gauge, CACHE_REQUESTS_TOTAL
+from services.file_utils import write_atomic, copy_atomic
+
+logger = logging.getLogger(__name__)
+
+
+def _params_token(*params):
+    return hashlib.sha1(repr((DERIVATIVE_VERSION,) + params).encode('ascii')).hexdigest()[:8]
+
+
+# Derivatives are served as immutable, so their names carry a token of the settings
+# they were made with: changing a size or quality yields new URLs, and the storage
+# sweep removes the old files as orphans. Thumbnails are resized from the PDF image.
+_PDF_TOKEN = _params_token(PDF_IMAGE_MAX_WIDTH, PDF_IMAGE_MAX_HEIGHT, PDF_IMAGE_JPEG_QUALITY)
+_THUMB_TOKEN = _params_token(_PDF_TOKEN, THUMB_MAX_SIZE, THUMB_WEBP_QUALITY, THUMB_JPEG_QUALITY)
+
+# Suffixes appended to the upload's file name, e.g. label_1707990000.jpg.thumb-1a2b3c4d.webp
+DERIVATIVE_SUFFIXES = {
+    'thumb_webp': f'.thumb-{_THUMB_TOKEN}.webp',
+    'thumb_jpg': f'.thumb-{_THUMB_TOKEN}.jpg',
+    'pdf': f'.pdf-{_PDF_TOKEN}.jpg',
+}
+
+# Background worker (created on first use so it is never inherited across fork)
+_executor = None
+# Uploads queued or in progress, so repeated requests do not queue duplicates
+_pending = set()
+_pending_lock = threading.Lock()
+# Uploads whose derivatives could not be made (unreadable, over the pixel cap):
+# not retried on every history listing or report in this process
+_failed = set()
+
+
+def _queue_depth():
+    return _executor._work_queue.qsize() if _executor is not None else 0
+
+
+register_queue_gauge(
+    'nutricheck_thumbnail_queue_depth', 'Uploads waiting for derivative generation.', _queue_depth)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix='thumbnails')
+    return _executor
+
+
+def derivative_paths(image_path):
+    """Return {kind: path} for every derivative of an upload."""
+    name = os.path.basename(image_path)
+    return {kind: os.path.join(DERIVED_FOLDER, name + suffix)
+            for kind, suffix in DERIVATIVE_SUFFIXES.items()}
+
+
+def source_name(derivative_name):
+    """Upload file name a derivative was generated from, or None if not a derivative."""
+    for suffix in DERIVATIVE_SUFFIXES.values():
+        if derivative_name.endswith(suffix):
+            return derivative_name[:-len(suffix)]
+    return None
+
+
+def _write_encoded(path, ext, img, params):
+    ok, encoded = cv2.imencode(ext, img, params)
+    if not ok:
+        raise ValueError(f"Could not encode {path}")
+    write_atomic(path, encoded.tobytes())
+
+
+def generate_derivatives(image_path):
+    """
+    Decode an upload once and write its PDF-sized JPEG plus WebP/JPEG
+    thumbnails. Existing derivatives are left alone.
+
+    Returns:
+        {kind: path} of the derivatives, or None if the image is unreadable
+        or too large
+    """
+    paths = derivative_paths(image_path)
+    if all(os.path.exists(p) for p in paths.values()):
+        return paths
+
+    try:
+        estimate = decode_estimate(image_path, PDF_IMAGE_MAX_WIDTH, PDF_IMAGE_MAX_HEIGHT)
+    except ValueError as e:
+        logger.warning("No derivatives for %s: %s", image_path, e)
+        return None
+    with image_budget.reserve(estimate):
+        return _write_derivatives(image_path, paths)
+
+
+def _write_derivatives(image_path, paths):
+    """Write all derivatives; the upload is decoded at reduced resolution."""
+    pdf_img = load_image(image_path, PDF_IMAGE_MAX_WIDTH, PDF_IMAGE_MAX_HEIGHT)
+    if pdf_img is None:
+        return None
+    os.makedirs(DERIVED_FOLDER, exist_ok=True)
+
+    size = read_image_size(image_path)
+    fits = size is not None and size[0] <= PDF_IMAGE_MAX_WIDTH and size[1] <= PDF_IMAGE_MAX_HEIGHT
+    if fits and image_path.lower().endswith(('.jpg', '.jpeg')):
+        # Already small enough: re-encoding a JPEG would only grow it
+        copy_atomic(image_path, paths['pdf'])
+    else:
+        _write_encoded(paths['pdf'], '.jpg', pdf_img,
+                      [cv2.IMWRITE_JPEG_QUALITY, PDF_IMAGE_JPEG_QUALITY, cv2.IMWRITE_JPEG_OPTIMIZE, 1])
+
+    # Thumbnails are derived from the report-sized image to keep resizes cheap
+    thumb = resize_image(pdf_img, THUMB_MAX_SIZE, THUMB_MAX_SIZE)
+    _write_encoded(paths['thumb_webp'], '.webp', thumb, [cv2.IMWRITE_WEBP_QUALITY, THUMB_WEBP_QUALITY])
+    _write_encoded(paths['thumb_jpg'], '.jpg', thumb,
+                  [cv2.IMWRITE_JPEG_QUALITY, THUMB_JPEG_QUALITY, cv2.IMWRITE_JPEG_OPTIMIZE, 1])
+    return paths
+
+
+def _generate_logged(image_path):
+    """generate_derivatives(), logging errors; failed uploads are remembered in _failed."""
+    try:
+        paths = generate_derivatives(image_path)
+    except Exception:
+        logger.exception("Derivative generation failed for %s", image_path)
+        paths = None
+    if paths is None:
+        _failed.add(image_path)
+    return paths
+
+
+def _generate_scheduled(image_path):
+    try:
+        return _generate_logged(image_path)
+    finally:
+        with _pending_lock:
+            _pending.discard(image_path)
+
+
+def schedule_derivatives(image_path):
+    """
+    Queue derivative generation on the background worker. Returns a Future,
+    or None if the upload is already queued or has failed before.
+    """
+    with _pending_lock:
+        if image_path in _pending or image_path in _failed:
+            return None
+        _pending.add(image_path)
+    return _get_executor().submit(_generate_scheduled, image_path)
+
+
+def pdf_image_path(image_path):
+    """
+    Path of the report-sized derivative, generating it inline if the
+    background worker has not produced it yet. None if the upload is
+    missing or cannot be safely decoded (reports then omit the image).
+    """
+    if not image_path or not os.path.exists(image_path):
+        return None
+    path = derivative_paths(image_path)['pdf']
+    if os.path.exists(path):
+        CACHE_REQUESTS_TOTAL.inc(cache='pdf_image', result='hit')
+        return path
+    CACHE_REQUESTS_TOTAL.inc(cache='pdf_image', result='miss')
+    if image_path in _failed:
+        return None
+    paths = _generate_logged(image_path)
+    return paths['pdf'] if paths else None
+
+
+def thumbnail_urls(image_path):
+    """
+    Static URLs of an upload's thumbnails ({} if the upload is not here or
+    cannot be decoded).
+    A derivative's name only changes with its settings, so the URLs are
+    returned even while the thumbnails are missing (new upload, derived folder cleared): they are
+    queued for generation and clients fall back to the upload until then.
+    """
+    # Rows written on another host may hold a foreign absolute path; the upload lives here
+    upload = os.path.join(UPLOAD_FOLDER, re.split(r'[\\/]', image_path)[-1])
+    paths = derivative_paths(upload)
+    # The JPEG thumbnail is written last: one stat per row when thumbnails exist
+    if not os.path.exists(paths['thumb_jpg']):
+        if upload in _failed or not os.path.exists(upload):
+            return {}
+        schedule_derivatives(upload)
+    return {
+        'thumb_url': '/static/derived/' + os.path.basename(paths['thumb_webp']),
+        'thumb_jpg_url': '/static/derived/' + os.path.basename(paths['thumb_jpg']),
+    }
@@ -194,6 +194,11 @@ const App = {
         document.getElementById('compareBtn').addEventListener('click', () => {
             Comparison.compare();
         });
+
+        // Comparison PDF
+        document.getElementById('comparePdfBtn').addEventListener('click', () => {
+            Comparison.downloadPdf();
+        });
     },
 
     clearPreview() {
@@ -215,49 +220,90 @@ const App = {
         const loading = document.getElementById('loadingOverlay');
         loading.classList.remove('hidden');
 
-        // Simulate progress steps
-        const steps = [
-            'Preprocessing image...',
-            'Running OCR extraction...',
-            'Parsing nutrients...',
-            'Calculating health score...',
-            'Generating results...'
-        ];
+        // Real progress from the server's stage events: each label names the
+        // step that starts once the keyed stage has finished
+        const stepLabels = {
+            preprocess: 'Running OCR extraction...',
+            ocr_pass_1: 'Reading product details...',
+            ocr_pass_2: 'Parsing nutrients...',
+            parse: 'Calculating health score...',
+            score: 'Saving results...',
+            saved: 'Generating results...'
+        };
         const stepEl = document.getElementById('loadingStep');
-        let stepIndex = 0;
-        const stepInterval = setInterval(() => {
-            stepIndex = Math.min(stepIndex + 1, steps.length - 1);
-            stepEl.textContent = steps[stepIndex];
-        }, 1500);
+        stepEl.textContent = 'Preprocessing image...';
 
         // Upload and analyze
         const formData = new FormData();
         formData.append('image', this.selectedFile);
 
         try {
-            const res = await fetch('/api/analyze', {
+            const res = await fetch('/api/analyze/stream', {
                 method: 'POST',
                 body: formData
             });
 
-            clearInterval(stepInterval);
-
             if (!res.ok) {
                 const err = await res.json();
                 throw new Error(err.error || 'Analysis failed');
             }
 
-            const data = await res.json();
-            this.showResults(data);
+            let result = null;
+            await this.readEventStream(res, (event, data) => {
+                if (event === 'stage') {
+                    stepEl.textContent = stepLabels[data.stage] || stepEl.textContent;
+                } else if (event === 'partial' && data.nutrients) {
+                    // Show nutrients while the score is still being computed
+                    document.getElementById('resultsSection').classList.remove('hidden');
+                    Dashboard.renderNutrients(data.nutrients);
+                } else if (event === 'result') {
+                    result = data;
+                } else if (event === 'error') {
+                    throw new Error(data.error || 'Analysis failed');
+                }
+            });
+
+            if (!result) throw new Error('Analysis ended without a result');
+            this.showResults(result);
 
         } catch (err) {
-            clearInterval(stepInterval);
             loading.classList.add('hidden');
+            document.getElementById('resultsSection').classList.add('hidden');
             this.clearPreview();
             alert(`Error: ${err.message}`);
         }
     },
 
+    /**
+     * Parse a text/event-stream response body, calling onEvent(event, data)
+     * for each Server-Sent Event as it arrives
+     */
+    async readEventStream(res, onEvent) {
+        const reader = res.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const block = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let event = 'message';
+                const dataLines = [];
+                block.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) event = line.slice(6).trim();
+                    else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+                });
+                if (dataLines.length) onEvent(event, JSON.parse(dataLines.join('\n')));
+            }
+        }
+    },
+
     showResults(data) {
         this.currentAnalysis = data;
 
@@ -5,15 +5,14 @@
 
 const Comparison = {
     selectedIds: new Set(),
+    comparedIds: [],
 
     /**
      * Load products for comparison selection
      */
     async load() {
         try {
-            const res = await fetch('/api/history');
-            if (!res.ok) throw new Error('Failed to load');
-            const data = await res.json();
+            const data = await HistoryStore.sync();
             this.renderSelection(data);
         } catch (err) {
             console.error('Comparison load error:', err);
@@ -38,6 +37,7 @@ const Comparison = {
 
         container.innerHTML = '';
         this.selectedIds.clear();
+        document.getElementById('compareActions').classList.add('hidden');
 
         products.forEach(p => {
             const item = document.createElement('label');
@@ -90,12 +90,38 @@ const Comparison = {
             });
             if (!res.ok) throw new Error('Comparison failed');
             const data = await res.json();
+            this.comparedIds = ids;
             this.renderResults(data);
         } catch (err) {
             console.error('Compare error:', err);
         }
     },
 
+    /**
+     * Download a PDF report comparing the last compared products
+     */
+    async downloadPdf() {
+        if (this.comparedIds.length < 2) return;
+        try {
+            const res = await fetch('/api/report/compare', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ ids: this.comparedIds })
+            });
+            if (!res.ok) throw new Error('PDF generation failed');
+
+            const blob = await res.blob();
+            const url = URL.createObjectURL(blob);
+            const a = document.createElement('a');
+            a.href = url;
+            a.download = 'nutricheck_comparison.pdf';
+            a.click();
+            URL.revokeObjectURL(url);
+        } catch (err) {
+            alert(`Error: ${err.message}`);
+        }
+    },
+
     /**
      * Render comparison results
      */
@@ -151,6 +177,8 @@ const Comparison = {
 
             container.appendChild(card);
         });
+
+        document.getElementById('compareActions').classList.remove('hidden');
     },
 
     /**
@@ -7,13 +7,11 @@ const History = {
     data: [],
 
     /**
-     * Load history from API
+     * Load history, fetching only changes since the cached version
      */
     async load() {
         try {
-            const res = await fetch('/api/history');
-            if (!res.ok) throw new Error('Failed to fetch history');
-            this.data = await res.json();
+            this.data = await HistoryStore.sync();
             this.render();
         } catch (err) {
             console.error('History load error:', err);
@@ -39,6 +37,24 @@ const History = {
         });
     },
 
+    /**
+     * Show the first image that loads: WebP thumbnail, JPEG thumbnail, then the upload.
+     * Thumbnails may not exist yet (or WebP be unsupported); hide the image if none loads.
+     */
+    loadThumb(img, item) {
+        const sources = [item.thumb_url, item.thumb_jpg_url, item.image_url].filter(Boolean);
+        const next = () => {
+            if (sources.length) {
+                img.src = sources.shift();
+            } else {
+                img.onerror = null;
+                img.style.display = 'none';
+            }
+        };
+        img.onerror = next;
+        next();
+    },
+
     /**
      * Create a history card element
      */
@@ -54,10 +70,7 @@ const History = {
         });
 
         card.innerHTML = `
-            <img class="history-thumb" 
-                 src="${item.image_url || '/static/images/placeholder.png'}" 
-                 alt="${item.product_name}"
-                 onerror="this.style.display='none'">
+            <img class="history-thumb" alt="${item.product_name}" loading="lazy">
             <div class="history-info">
                 <div class="history-name">${item.product_name || 'Unknown Product'}</div>
                 <div class="history-date">${date}</div>
@@ -70,6 +83,8 @@ const History = {
             </div>
         `;
 
+        this.loadThumb(card.querySelector('.history-thumb'), item);
+
         // Click card to view results
         card.addEventListener('click', (e) => {
             if (e.target.closest('[data-delete]')) return;
@@ -112,6 +127,7 @@ const History = {
         try {
             const res = await fetch(`/api/analysis/${id}`, { method: 'DELETE' });
             if (res.ok) {
+                HistoryStore.remove(id);
                 this.data = this.data.filter(a => a.id !== id);
                 this.render();
             }
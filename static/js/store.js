@@ -0,0 +1,86 @@
+/**
+ * NutriCheck – History Store
+ * Local cache of analysis history, kept current with /api/history/changes deltas
+ */
+
+const HistoryStore = {
+    // Bumped when cached items change shape, so old caches are resynced
+    STORAGE_KEY: 'nutricheck.history.v2',
+    version: 0,
+    epoch: '',
+    items: new Map(),
+    loaded: false,
+
+    /**
+     * Restore the cache saved by a previous visit
+     */
+    restore() {
+        this.loaded = true;
+        try {
+            const saved = JSON.parse(localStorage.getItem(this.STORAGE_KEY));
+            if (saved && Array.isArray(saved.items)) {
+                this.version = saved.version || 0;
+                this.epoch = saved.epoch || '';
+                this.items = new Map(saved.items.map(item => [item.id, item]));
+            }
+        } catch (err) {
+            console.warn('History cache unreadable, resyncing:', err);
+        }
+    },
+
+    /**
+     * Persist the cache; storage may be full or disabled, which only costs a full resync
+     */
+    save() {
+        try {
+            localStorage.setItem(this.STORAGE_KEY, JSON.stringify({
+                version: this.version,
+                epoch: this.epoch,
+                items: Array.from(this.items.values())
+            }));
+        } catch (err) {
+            console.warn('History cache not saved:', err);
+        }
+    },
+
+    /**
+     * Fetch and apply changes since the cached cursor; returns the history list
+     */
+    async sync() {
+        if (!this.loaded) this.restore();
+
+        let hasMore = true;
+        while (hasMore) {
+            const params = new URLSearchParams({ since: this.version, epoch: this.epoch });
+            const res = await fetch(`/api/history/changes?${params}`);
+            if (!res.ok) throw new Error('Failed to fetch history changes');
+            const delta = await res.json();
+
+            if (delta.reset) this.items.clear();
+            delta.upserts.forEach(item => this.items.set(item.id, item));
+            delta.deleted.forEach(id => this.items.delete(id));
+            this.version = delta.version;
+            this.epoch = delta.epoch;
+            hasMore = delta.has_more;
+        }
+
+        this.save();
+        return this.list();
+    },
+
+    /**
+     * Drop an item the user deleted, without waiting for the next sync
+     */
+    remove(id) {
+        this.items.delete(id);
+        this.save();
+    },
+
+    /**
+     * Cached analyses, most recent first
+     */
+    list() {
+        return Array.from(this.items.values()).sort((a, b) =>
+            (b.created_at || '').localeCompare(a.created_at || '') || b.id - a.id);
+    }
+};
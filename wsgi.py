@@ -0,0 +1,34 @@
+"""
+Production WSGI entry point.
+
+Imported once by the gunicorn master (preload_app): the database schema
+is created, static assets are fingerprinted, and the EasyOCR model is
+loaded here, before workers fork, so every worker shares the model
+weights copy-on-write instead of loading its own copy.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+import gc
+import logging
+from app import app
+from database import init_db
+from config import OCR_MODE
+from services.ocr_service import preload_reader
+from services.asset_service import build_assets, serve_sources
+
+logger = logging.getLogger(__name__)
+
+init_db()
+try:
+    build_assets()
+except OSError as e:
+    # e.g. a read-only deploy directory: pages link the unbuilt /static sources instead
+    logger.warning("Could not build static assets, serving sources: %s", e)
+    serve_sources()
+if OCR_MODE != 'replay':
+    preload_reader()
+
+# Move everything loaded so far out of the GC's generations: collections in
+# the workers then never write to these pages, which keeps them shared
+gc.collect()
+gc.freeze()